@@ -856,6 +856,10 @@ async def start_login_sequence():
     # implement idle timeout now that we are logged-in
     IMPT.start_task('idle', idle_logout())
 
+    # fill address ownership caches in background, when idle (if enabled)
+    from ownership import prewarm_task
+    IMPT.start_task('addr-warm', prewarm_task())
+
     # Populate xfp/xpub values, if missing.
     # - can happen for first-time login of duress wallet
     # - may indicate lost settings, which we can easily recover from
@@ -1895,6 +1899,20 @@ async def verify_sig_file(*a):
     await verify_txt_sig_file(fn)
 
 
+async def verify_addr_file(*a):
+    # check a list of addresses, one per line, are ours
+    from ownership import MAX_BATCH_ADDRS
+
+    fn = await file_picker(suffix=['.txt', '.csv'], min_size=20, max_size=MAX_BATCH_ADDRS*100,
+                           none_msg='Must be text file with one address per line.')
+
+    if not fn:
+        return
+
+    from auth import verify_address_file
+    await verify_address_file(fn)
+
+
 async def main_pin_changer(*a):
     # Help them to change the main (true) PIN with appropriate warnings.
     # - the bootloader maybe lying to us about main vs trick pin
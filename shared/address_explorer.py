@@ -4,7 +4,7 @@
 #
 # Address Explorer menu functionality
 #
-import chains, stash, version
+import chains, stash, version, sys, uasyncio
 from ux import ux_show_story, the_ux, ux_enter_bip32_index
 from ux import export_prompt_builder, import_export_prompt_decode
 from menu import MenuSystem, MenuItem
@@ -19,6 +19,12 @@ from utils import addr_fmt_label, censor_address
 from charcodes import KEY_QR, KEY_NFC, KEY_PAGE_UP, KEY_PAGE_DOWN, KEY_HOME, KEY_LEFT, KEY_RIGHT
 from charcodes import KEY_CANCEL
 
+# CSV export: rows per write to card (and per progress bar update)
+CSV_CHUNK_ROWS = const(50)
+
+# Explorer: how many pages of addresses to keep, per wallet branch
+PAGE_CACHE_PAGES = const(4)
+
 def truncate_address(addr):
     # Truncates address to width of screen, replacing middle chars
     if not version.has_qwerty:
@@ -159,6 +165,105 @@ class SamouraiAppMenu(MenuSystem):
         super().__init__(items)
 
 
+class AddressPageCache:
+    # Pages of addresses recently shown from one wallet branch, plus the branch
+    # node, so scrolling back and forth needs no trips to the secure element.
+    # - next page is made in the background, while current one is being read
+    # - node is public-only, but still blanked when done: call forget()
+
+    def __init__(self, wallet, change_idx, n):
+        self.wallet = wallet
+        self.change_idx = change_idx
+        self.n = n
+        self.pages = {}         # start idx => list of rows from yield_addresses
+        self.order = []         # page starts, oldest first
+        self.node = None
+        self.task = None
+        self.task_num = 0       # which prefetch is current
+
+        if not isinstance(wallet, MultisigWallet):
+            self.path = wallet.branch_path(change_idx)
+
+    def generate(self, start):
+        w = self.wallet
+        if isinstance(w, MultisigWallet):
+            # cosigner nodes already cached inside wallet
+            yield from w.yield_addresses(start, self.n, self.change_idx)
+            return
+
+        if self.node is None:
+            self.node = w.branch_node(self.path)
+
+        for idx, addr in w.address_range(self.node, start, self.n):
+            yield idx, addr, self.path + str(idx)
+
+    def keep(self, start, rows):
+        if start in self.pages:
+            # made twice; first one is as good
+            return
+        self.pages[start] = rows
+        self.order.append(start)
+        if len(self.order) > PAGE_CACHE_PAGES:
+            self.pages.pop(self.order.pop(0), None)
+
+    def rows(self, start):
+        # page of addresses, made now if we don't have it (w/ progress bar)
+        from glob import dis
+
+        rv = self.pages.get(start)
+        if rv is not None:
+            return rv
+
+        self.stop()
+
+        rv = []
+        for row in self.generate(start):
+            rv.append(row)
+            dis.progress_sofar(len(rv), self.n)
+
+        self.keep(start, rv)
+
+        return rv
+
+    def prefetch(self, start):
+        # start making a page in background, if we haven't got it already
+        if start in self.pages:
+            return
+        self.stop()
+        self.task_num += 1
+        self.task = uasyncio.create_task(self.make_page(start, self.task_num))
+
+    async def make_page(self, start, num):
+        try:
+            rv = []
+            for row in self.generate(start):
+                rv.append(row)
+                # let UX have the CPU between addresses
+                await sleep_ms(0)
+
+            self.keep(start, rv)
+        except Exception as exc:
+            # just a cache: page will be made when needed instead
+            sys.print_exception(exc)
+        finally:
+            # a cancelled task gets here after its replacement has started
+            if num == self.task_num:
+                self.task = None
+
+    def stop(self):
+        # abandon any background work
+        if self.task:
+            self.task.cancel()
+            self.task = None
+
+    def forget(self):
+        self.stop()
+        self.pages.clear()
+        self.order.clear()
+        stash.blank_object(self.node)
+        self.node = None
+
+
 class AddressListMenu(MenuSystem):
 
     def __init__(self):
@@ -298,7 +403,7 @@ Press (3) if you really understand and accept these risks.
                 # - makes a redeem script
                 # - converts into addr
                 # - assumes 0/0 is first address.
-                for idx, addr, paths, script in ms_wallet.yield_addresses(start, n, change):
+                for idx, addr, paths, script in cache.rows(start):
                     addrs.append(censor_address(addr))
 
                     if idx == 0 and ms_wallet.N <= 4:
@@ -307,20 +412,20 @@ Press (3) if you really understand and accept these risks.
                         msg += '⋯/%d/%d =>\n' % (change, idx)
 
                     msg += truncate_address(addr) + '\n\n'
-                    dis.progress_sofar(idx-start+1, n)
 
             else:
                 # single-signer wallets
-                from wallet import MasterSingleSigWallet
-                main = MasterSingleSigWallet(addr_fmt, path, self.account_num)
-
                 from ownership import OWNERSHIP
                 OWNERSHIP.note_wallet_used(addr_fmt, self.account_num)
 
-                for idx, addr, deriv in main.yield_addresses(start, n, change if allow_change else None):
+                if cache:
+                    rows = cache.rows(start)
+                else:
+                    rows = main.yield_addresses(start, n, None)
+
+                for idx, addr, deriv in rows:
                     addrs.append(addr)
                     msg += "%s =>\n%s\n\n" % (deriv, addr)
-                    dis.progress_sofar(idx-start+1, n or 1)
 
             # export options
             k0 = 'to show change addresses' if allow_change and change == 0 else None
@@ -342,73 +447,96 @@ Press (3) if you really understand and accept these risks.
 
             return msg, addrs, escape
 
-        msg, addrs, escape = make_msg()
-        change = 0
-        while 1:
-            ch = await ux_show_story(msg, escape=escape)
-
-            choice = import_export_prompt_decode(ch)
-
-            if choice == KEY_CANCEL:
-                return
-
-            if isinstance(choice, dict):
-                # save addresses to MicroSD/VirtDisk
-                c = n if n is None else 250
-                if c and (self.start + c) > MAX_BIP32_IDX:
-                    c = MAX_BIP32_IDX - self.start + 1
-                await make_address_summary_file(path, addr_fmt, ms_wallet,
-                                        self.account_num, count=c, start=self.start,
-                                        change=change if allow_change else None, **choice)
+        def make_cache(change=0):
+            if not n:
+                # single address, nothing to page thru
+                return None
+            return AddressPageCache(ms_wallet or main, change if allow_change else None, n)
+
+        if not ms_wallet:
+            from wallet import MasterSingleSigWallet
+            main = MasterSingleSigWallet(addr_fmt, path, self.account_num)
+
+        cache = make_cache()
+        try:
+            msg, addrs, escape = make_msg()
+            change = 0
+            while 1:
+                if cache and start + n <= MAX_BIP32_IDX:
+                    # probably want the next page after this one
+                    cache.prefetch(start + n)
+
+                ch = await ux_show_story(msg, escape=escape)
+
+                choice = import_export_prompt_decode(ch)
+
+                if choice == KEY_CANCEL:
+                    return
+
+                if isinstance(choice, dict):
+                    # save addresses to MicroSD/VirtDisk
+                    c = n if n is None else 250
+                    if c and (self.start + c) > MAX_BIP32_IDX:
+                        c = MAX_BIP32_IDX - self.start + 1
+                    await make_address_summary_file(path, addr_fmt, ms_wallet,
+                                            self.account_num, count=c, start=self.start,
+                                            change=change if allow_change else None, **choice)
+
+                    # continue on same screen in case they want to write to multiple cards
+
+                elif choice == KEY_QR:
+                    # switch into a mode that shows them as QR codes
+                    if ms_wallet:
+                        # requires not multisig
+                        continue
 
-                # continue on same screen in case they want to write to multiple cards
+                    from ux import show_qr_codes
+                    is_alnum = bool(addr_fmt & (AFC_BECH32 | AFC_BECH32M))
+                    await show_qr_codes(addrs, is_alnum, start)
 
-            elif choice == KEY_QR:
-                # switch into a mode that shows them as QR codes
-                if ms_wallet:
-                    # requires not multisig
                     continue
 
-                from ux import show_qr_codes
-                is_alnum = bool(addr_fmt & (AFC_BECH32 | AFC_BECH32M))
-                await show_qr_codes(addrs, is_alnum, start)
-
-                continue
-
-            elif NFC and (choice == KEY_NFC):
-                # share table over NFC
-                if len(addrs) == 1:
-                    await NFC.share_text(addrs[0])
-                else:
-                    await NFC.share_text('\n'.join(addrs))
+                elif NFC and (choice == KEY_NFC):
+                    # share table over NFC
+                    if len(addrs) == 1:
+                        await NFC.share_text(addrs[0])
+                    else:
+                        await NFC.share_text('\n'.join(addrs))
 
-                continue
+                    continue
 
-            elif choice == '0' and allow_change:
-                change = 1
-            elif n is None:
-                # makes no sense to do any of below, showing just single address
-                continue
-            elif ch in (KEY_LEFT+"7"):
-                # go backwards in explorer
-                if start - n < 0:
-                    if start == 0:
+                elif choice == '0' and allow_change:
+                    change = 1
+                    if cache:
+                        cache.forget()
+                    cache = make_cache(change)
+                elif n is None:
+                    # makes no sense to do any of below, showing just single address
+                    continue
+                elif ch in (KEY_LEFT+"7"):
+                    # go backwards in explorer
+                    if start - n < 0:
+                        if start == 0:
+                            continue
+                        start = 0
+                    else:
+                        start -= n
+                elif ch in (KEY_RIGHT+"9"):
+                    # go forwards
+                    if start + n > MAX_BIP32_IDX:
                         continue
+                    else:
+                        start += n
+                elif ch == KEY_HOME:
                     start = 0
                 else:
-                    start -= n
-            elif ch in (KEY_RIGHT+"9"):
-                # go forwards
-                if start + n > MAX_BIP32_IDX:
-                    continue
-                else:
-                    start += n
-            elif ch == KEY_HOME:
-                start = 0
-            else:
-                continue        # 3 in non-NFC mode
+                    continue        # 3 in non-NFC mode
 
-            msg, addrs, escape = make_msg(change)
+                msg, addrs, escape = make_msg(change)
+        finally:
+            # nodes and addresses not kept after explorer exits
+            if cache:
+                cache.forget()
 
 def generate_address_csv(path, addr_fmt, ms_wallet, account_num, n, start=0, change=0):
     # Produce CSV file contents as a generator
@@ -485,15 +613,25 @@ async def make_address_summary_file(path, addr_fmt, ms_wallet, account_num,
         with CardSlot(**save_opts) as card:
             fname, nice = card.pick_filename(fname_pattern)
             h = sha256()
-            # do actual write
+            # do actual write, many rows at a time
             with open(fname, 'wb') as fd:
-                for idx, part in enumerate(body):
-                    ep = part.encode()
+                rows = []
+
+                def flush():
+                    ep = ''.join(rows).encode()
                     fd.write(ep)
                     if not ms_wallet:
                         h.update(ep)
+                    rows.clear()
+
+                for idx, part in enumerate(body):
+                    rows.append(part)
+                    if len(rows) >= CSV_CHUNK_ROWS:
+                        flush()
+                        dis.progress_sofar(idx, count or 1)
 
-                    dis.progress_sofar(idx, count or 1)
+                if rows:
+                    flush()
 
             sig_nice = None
             if not ms_wallet:
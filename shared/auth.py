@@ -3,7 +3,7 @@
 # Operations that require user authorization, like our core features: signing messages
 # and signing bitcoin transactions.
 #
-import stash, ure, ux, chains, sys, gc, uio, version, ngu, ujson
+import stash, ure, ux, chains, sys, gc, uio, version, ngu, ujson, phases
 from ubinascii import b2a_base64, a2b_base64
 from ubinascii import hexlify as b2a_hex
 from ubinascii import unhexlify as a2b_hex
@@ -27,6 +27,12 @@ from charcodes import KEY_QR, KEY_NFC, KEY_ENTER, KEY_CANCEL, KEY_LEFT, KEY_RIGH
 TXN_INPUT_OFFSET = 0
 TXN_OUTPUT_OFFSET = MAX_TXN_LEN
 
+# HSM signing queue: slots carved from the output area, each holding
+# a PSBT, followed by the result of signing it
+QUEUE_SLOTS = const(4)
+QUEUE_SLOT_LEN = MAX_TXN_LEN // QUEUE_SLOTS
+QUEUE_MAX_PSBT = QUEUE_SLOT_LEN // 2
+
 class UserAuthorizedAction:
     active_request = None
 
@@ -611,6 +617,10 @@ class ApproveTransaction(UserAuthorizedAction):
         self.result = None      # will be (len, sha256) of the resulting PSBT
         self.is_sd = is_sd
         self.chain = chains.current_chain()
+        self.auth = None        # HSM user auth, when captured ahead of time
+        self.input_offset = TXN_INPUT_OFFSET
+        self.output_offset = TXN_OUTPUT_OFFSET
+        self.output_max = MAX_TXN_LEN
 
     def render_output(self, o):
         # Pretty-print a transactions output. 
@@ -641,14 +651,22 @@ class ApproveTransaction(UserAuthorizedAction):
 
         return '%s\n - to script -\n%s\n' % (val, dest)
 
+    def done(self, redraw=True):
+        # close out phase timings (if enabled), whatever the outcome
+        phases.end('refused' if self.refused else ('failed' if self.failed else 'ok'))
+        super().done(redraw=redraw)
+
     async def interact(self):
         # Prompt user w/ details and get approval
         from glob import dis, hsm_active
 
+        # dev/simulator only: record time and heap use of each step below
+        phases.begin('psbt')
+
         # step 1: parse PSBT from PSRAM into in-memory objects.
 
         try:
-            with SFFile(TXN_INPUT_OFFSET, length=self.psbt_len, message='Reading...') as fd:
+            with SFFile(self.input_offset, length=self.psbt_len, message='Reading...') as fd:
                 # NOTE: psbtObject captures the file descriptor and uses it later
                 self.psbt = psbtObject.read_psbt(fd)
         except BaseException as exc:
@@ -660,20 +678,25 @@ class ApproveTransaction(UserAuthorizedAction):
 
             return await self.failure(msg, exc)
 
+        phases.mark('parse')
         dis.fullscreen("Validating...")
 
         # Do some analysis/ validation
         try:
             await self.psbt.validate()      # might do UX: accept multisig import
+            phases.mark('validate')
             dis.progress_bar_show(0.10)
             self.psbt.consider_inputs()
+            phases.mark('inputs')
 
             dis.progress_bar_show(0.33)
             self.psbt.consider_keys()
+            phases.mark('keys')
 
             dis.progress_bar_show(0.66)
             self.psbt.consider_outputs()
             self.psbt.consider_dangerous_sighash()
+            phases.mark('outputs')
 
             dis.progress_bar_show(0.85)
         except FraudulentChangeOutput as exc:
@@ -737,6 +760,7 @@ class ApproveTransaction(UserAuthorizedAction):
             # outputs + change story created here
             needs_txn_explorer = self.output_summary_text(msg)
             gc.collect()
+            phases.mark('summary')
 
             if self.psbt.ux_notes:
                 # currently we only have locktimes in ux_notes
@@ -778,7 +802,8 @@ class ApproveTransaction(UserAuthorizedAction):
                         del msg
                         break
             else:
-                ch = await hsm_active.approve_transaction(self.psbt, self.psbt_sha, msg.getvalue())
+                ch = await hsm_active.approve_transaction(self.psbt, self.psbt_sha,
+                                                          msg.getvalue(), auth=self.auth)
                 dis.progress_bar_show(1)     # finish the Validating...
 
         except MemoryError:
@@ -803,6 +828,9 @@ class ApproveTransaction(UserAuthorizedAction):
             self.done()
             return
 
+        # time spent waiting on the user (or HSM policy)
+        phases.mark('approve')
+
         # do the actual signing.
         try:
             dis.fullscreen('Wait...')
@@ -828,7 +856,7 @@ class ApproveTransaction(UserAuthorizedAction):
         txid = None
         try:
             # re-serialize the PSBT back out
-            with SFFile(TXN_OUTPUT_OFFSET, max_size=MAX_TXN_LEN, message="Saving...") as fd:
+            with SFFile(self.output_offset, max_size=self.output_max, message="Saving...") as fd:
                 if self.do_finalize:
                     txid = self.psbt.finalize(fd)
                 else:
@@ -836,6 +864,7 @@ class ApproveTransaction(UserAuthorizedAction):
 
                 self.result = (fd.tell(), fd.checksum.digest())
 
+            phases.mark('finalize' if self.do_finalize else 'save')
             self.done(redraw=(not txid))
 
         except BaseException as exc:
@@ -930,7 +959,7 @@ class ApproveTransaction(UserAuthorizedAction):
 
         chk = self.chain.hash_message(msg_len=txt_len) if sign_text else None
 
-        with SFFile(TXN_OUTPUT_OFFSET, max_size=txt_len+300, message="Visualizing...") as fd:
+        with SFFile(self.output_offset, max_size=txt_len+300, message="Visualizing...") as fd:
             while 1:
                 blk = msg.read(256).encode('ascii')
                 if not blk: break
@@ -1047,11 +1076,113 @@ class ApproveTransaction(UserAuthorizedAction):
 def sign_transaction(psbt_len, flags=0x0, psbt_sha=None):
     # transaction (binary) loaded into PSRAM already, checksum checked
     UserAuthorizedAction.check_busy(ApproveTransaction)
+    if QueuedTransaction.num_queued():
+        # would overwrite their slots
+        raise CCBusyError()
+
     UserAuthorizedAction.active_request = ApproveTransaction(psbt_len, flags, psbt_sha=psbt_sha)
 
     # kill any menu stack, and put our thing at the top
     abort_and_goto(UserAuthorizedAction.active_request)
 
+class QueuedTransaction(ApproveTransaction):
+    # HSM mode: a PSBT waiting in its own PSRAM slot. Jobs are signed in the
+    # order queued, back-to-back from the HSM loop, without any UX between them.
+    slots = [None] * QUEUE_SLOTS
+    counter = 0
+
+    def __init__(self, slot, psbt_len, flags, psbt_sha, auth):
+        super().__init__(psbt_len, flags, psbt_sha=psbt_sha)
+        self.slot = slot
+        self.auth = auth
+        self.collected = False      # result reported by qtok
+        self.input_offset = TXN_OUTPUT_OFFSET + (slot * QUEUE_SLOT_LEN)
+        self.output_offset = self.input_offset + QUEUE_MAX_PSBT
+        self.output_max = QUEUE_SLOT_LEN - QUEUE_MAX_PSBT
+
+        QueuedTransaction.counter += 1
+        self.seq = QueuedTransaction.counter
+
+    def done(self, redraw=True):
+        # nothing to unwind; stay on the HSM screen
+        # - only result/refused/failed needed from here, so free the heap for next job
+        phases.end('refused' if self.refused else ('failed' if self.failed else 'ok'))
+        self.psbt = None
+        self.ux_done = True
+
+    @classmethod
+    def num_queued(cls):
+        return sum(1 for j in cls.slots if j)
+
+    @classmethod
+    def next_job(cls):
+        # oldest job not yet signed, or None
+        rv = None
+        for j in cls.slots:
+            if j and not j.ux_done and (not rv or j.seq < rv.seq):
+                rv = j
+        return rv
+
+    @classmethod
+    def collect(cls, slot):
+        # job in slot, if finished
+        # - slot stays in use until its result is downloaded, if it has one
+        job = cls.slots[slot]
+        assert job, 'empty slot'
+        if not job.ux_done:
+            return None
+
+        if job.collected:
+            # asked again, so they aren't going to download it: give up slot
+            cls.slots[slot] = None
+            raise ValueError('released')
+
+        job.collected = True
+        if not job.result:
+            cls.slots[slot] = None
+
+        return job
+
+    @classmethod
+    def result_ready(cls, slot):
+        job = cls.slots[slot]
+        return bool(job and job.collected)
+
+    @classmethod
+    def downloaded(cls, slot, end):
+        # host has read result of job up to end: slot is free once all of it
+        job = cls.slots[slot]
+        if job and job.collected and end >= job.result[0]:
+            cls.slots[slot] = None
+
+    @classmethod
+    def clear_queue(cls):
+        cls.slots = [None] * QUEUE_SLOTS
+        gc.collect()
+
+def queue_transaction(psbt_len, flags=0x0, psbt_sha=None):
+    # HSM mode: move uploaded PSBT into a free queue slot, return slot number
+    # - approvals given so far (USB 'user' cmd) go with it
+    from glob import hsm_active, PSRAM
+
+    UserAuthorizedAction.check_busy()
+    try:
+        slot = QueuedTransaction.slots.index(None)
+    except ValueError:
+        raise CCBusyError()
+
+    job = QueuedTransaction(slot, psbt_len, flags, psbt_sha, hsm_active.pending_auth)
+    hsm_active.pending_auth = {}
+
+    # PSRAM to PSRAM, so the upload area is free for the next one right away
+    for pos in range(0, psbt_len, 16384):
+        here = min(16384, psbt_len - pos)
+        PSRAM.write(job.input_offset + pos, PSRAM.read_at(TXN_INPUT_OFFSET + pos, here))
+
+    QueuedTransaction.slots[slot] = job
+
+    return slot
+
 def psbt_encoding_taster(taste, psbt_len):
     # look at first 10 bytes, and detect file encoding (binary, hex, base64)
     # - return len is upper bound on size because of unknown whitespace
@@ -1288,6 +1419,81 @@ def start_remote_backup():
     abort_and_goto(UserAuthorizedAction.active_request)
 
 
+class VerifyAddressBatch(UserAuthorizedAction):
+    def __init__(self, sf_len):
+        super().__init__()
+        self.sf_len = sf_len
+        # self.result ... will be (len, sha256) of the CSV results file
+
+    async def interact(self):
+        # No approval needed: only reports what we know about our own addresses,
+        # but can take a while to build the address caches.
+        from ownership import OWNERSHIP
+
+        try:
+            with SFFile(TXN_INPUT_OFFSET, length=self.sf_len, message='Reading...') as fd:
+                lines = fd.read(self.sf_len).decode().split('\n')
+
+            body, _, _ = OWNERSHIP.search_batch(lines)
+            del lines
+
+            with SFFile(TXN_OUTPUT_OFFSET, max_size=MAX_TXN_LEN, message="Saving...") as fd:
+                for part in body:
+                    fd.write(part.encode())
+
+                self.result = (fd.tell(), fd.checksum.digest())
+
+            self.done()
+
+        except BaseException as exc:
+            return await self.failure("Address verify failed", exc)
+
+
+def start_verify_addresses(sf_len):
+    # check a list of addresses, uploaded over USB; results to be downloaded
+    UserAuthorizedAction.cleanup()
+    UserAuthorizedAction.active_request = VerifyAddressBatch(sf_len)
+
+    # kill any menu stack, and put our thing at the top
+    abort_and_goto(UserAuthorizedAction.active_request)
+
+
+async def verify_address_file(filename):
+    # check a list of addresses found in a text file on MicroSD/VDisk,
+    # and write results next to it
+    from files import CardMissingError, needs_microsd
+    from ownership import OWNERSHIP
+    from glob import dis
+
+    try:
+        with CardSlot(readonly=True) as card:
+            with card.open(filename, 'rt') as fd:
+                lines = fd.read().split('\n')
+
+        body, hits, count = OWNERSHIP.search_batch(lines)
+        del lines
+
+        orig_path, basename = filename.rsplit('/', 1)
+        base = basename.rsplit('.', 1)[0]
+
+        dis.fullscreen("Saving...")
+        with CardSlot() as card:
+            out_full, out_fn = card.pick_filename(base+'-verified.csv', orig_path + '/')
+            with card.open(out_full, 'wt') as fd:
+                for part in body:
+                    fd.write(part)
+
+    except CardMissingError:
+        await needs_microsd()
+        return
+    except Exception as e:
+        await ux_show_story('Failed to verify!\n\n\n%s\n%s' % (e, problem_file_line(e)))
+        return
+
+    msg = 'Found %d of %d addresses.\n\nResults file written:\n\n%s' % (hits, count, out_fn)
+    await ux_show_story(msg, title='Verified' if hits == count else 'Not All Found')
+
+
 class NewPassphrase(UserAuthorizedAction):
     def __init__(self, pw):
         super().__init__()
@@ -240,6 +240,25 @@ class ChainsBase:
 
         raise ValueError('Unknown payment script', repr(script))
 
+    @classmethod
+    def address_to_script(cls, addr):
+        # reverse of render_address(): payment address back to scriptPubKey
+        # - raises ValueError if not an address on this chain
+        if addr.lower().startswith(cls.bech32_hrp + '1'):
+            hrp, version, data = ngu.codecs.segwit_decode(addr)
+            if hrp != cls.bech32_hrp:
+                raise ValueError('wrong chain')
+            return bytes([(OP_1 - 1 + version) if version else 0, len(data)]) + data
+
+        raw = ngu.codecs.b58_decode(addr)
+        if len(raw) == 21:
+            if raw[0:1] == cls.b58_addr:
+                return b'\x76\xA9\x14' + raw[1:] + b'\x88\xAC'
+            if raw[0:1] == cls.b58_script:
+                return b'\xA9\x14' + raw[1:] + b'\x87'
+
+        raise ValueError('not a payment address')
+
     @classmethod
     def op_return(cls, script):
         """Returns decoded string op return data if script is op return otherwise None"""
@@ -213,6 +213,7 @@ FileMgmtMenu = [
     MenuItem('Batch Sign PSBT', predicate=has_secrets, f=batch_sign),
     MenuItem('List Files', f=list_files),
     MenuItem('Verify Sig File', f=verify_sig_file),
+    MenuItem('Verify Addresses', predicate=has_secrets, f=verify_addr_file),
     MenuItem('NFC File Share', predicate=nfc_enabled, f=nfc_share_file, shortcut=KEY_NFC),
     MenuItem('QR File Share', predicate=version.has_qr, f=qr_share_file, shortcut=KEY_QR),
     MenuItem('Clone Coldcard', predicate=has_secrets, f=clone_write_data),
@@ -297,6 +298,21 @@ DangerZoneMenu = [
     MenuItem('Wipe HSM Policy', f=wipe_hsm_policy, predicate=hsm_policy_available),
     MenuItem('Clear OV cache', f=wipe_ovc),
     MenuItem("Clear Address cache" if version.has_qwerty else "Clear Addr cache", f=wipe_address_cache),
+    ToggleMenuItem('Addr Cache Depth', 'aocd', ['Default 764', '5,000', '10,000', '20,000'],
+                   value_map=[764, 5000, 10000, 20000],
+                   story=("Number of addresses per wallet to remember for ownership search. "
+                          "Deeper caches find high-index addresses without regenerating "
+                          "them, but use more flash: about 2k per 764 addresses, "
+                          "for each wallet searched, and again for change.")),
+    ToggleMenuItem('Addr Cache Hash', 'aohl', ['Default 2 bytes', '4 bytes', '8 bytes'],
+                   value_map=[2, 4, 8],
+                   story=("Length of hash kept for each cached address. Longer hashes "
+                          "have fewer false matches to re-check, but use more flash. "
+                          "Applies to newly cached addresses only.")),
+    ToggleMenuItem('Addr Cache Warm', 'aobg', ['Default Off', 'Enable'],
+                   story=("Build address caches in the background, while sitting idle "
+                          "at a menu, so ownership searches are quick the first time. "
+                          "Covers every known wallet, and writes to flash as it goes.")),
     ToggleMenuItem("Sighash Checks", "sighshchk", ["Default: Block", "Warn"],
                    invert=True,
                    story='''\
@@ -9,7 +9,7 @@ from sffile import SFFile
 from utils import problem_file_line, cleanup_deriv_path, match_deriv_path
 from pincodes import AE_LONG_SECRET_LEN
 from stash import blank_object
-from users import Users, MAX_NUMBER_USERS, calc_local_pincode
+from users import Users, UserAuthCache, MAX_NUMBER_USERS, calc_local_pincode
 from public_constants import MAX_USERNAME_LEN
 from multisig import MultisigWallet
 from ubinascii import hexlify as b2a_hex
@@ -31,6 +31,12 @@ MAX_SATS = const(2100000000000000)
 # too many refusals will cause reset
 ABSOLUTE_MAX_REFUSALS = const(100)
 
+# audit log entries are written to card when this old, or this many bytes are waiting
+LOG_FLUSH_MS = const(2000)
+LOG_FLUSH_BYTES = const(8192)
+# .. and oldest are dropped past this, if card can't be written
+LOG_MAX_PENDING = const(65536)
+
 # you have this many seconds after boot to escape HSM
 # mode, if you enable the boot_to_hsm feature
 BOOT_LOCKOUT_TIME = const(60)
@@ -151,8 +157,8 @@ def assert_empty_dict(j):
 
 def cleanup_whitelist_value(s):
     # one element in a list of addresses or paths or descriptors?
-    # - later matching is string-based, so just doing basic syntax check here
-    # - must be checksumed-base58 or bech32
+    # - just a basic syntax check here; must be checksumed-base58 or bech32
+    # - rules match on the scriptPubKey decoded from it, or the text (attest mode)
     try:
         ngu.codecs.b58_decode(s)
         return s
@@ -166,6 +172,14 @@ def cleanup_whitelist_value(s):
     raise ValueError('bad whitelist value: ' + s)
 
 
+def render_dest(chain, script):
+    # text for an output's destination, for humans and the log
+    try:
+        return chain.render_address(script)
+    except ValueError:
+        return str(b2a_hex(script), 'ascii')
+
+
 class WhitelistOpts:
     # contains various options related to whitelisting
     def __init__(self, from_dict):
@@ -247,6 +261,30 @@ class ApprovalRule:
 
         assert_empty_dict(j)
 
+        self.compile()
+
+    def compile(self):
+        # Precompute what matching needs, so nothing is rebuilt per transaction.
+        opts = self.whitelist_opts
+        self.whitelist_set = frozenset(self.whitelist)
+
+        # outputs are checked by their scriptPubKey, so decode addresses once here
+        # - any not valid on this chain could never match, so leave them out
+        chain = chains.current_chain()
+        scripts = set()
+        for addr in self.whitelist:
+            try:
+                scripts.add(chain.address_to_script(addr))
+            except ValueError:
+                pass
+        self.whitelist_scripts = frozenset(scripts)
+        self.attest_mode = bool(opts and opts.attest)
+        self.allow_zeroval = bool(opts and opts.allow_zeroval_outs)
+
+        self.eq_num_ins_outs = "EQ_NUM_INS_OUTS" in self.patterns
+        self.eq_num_own_ins_outs = "EQ_NUM_OWN_INS_OUTS" in self.patterns
+        self.eq_out_amounts = "EQ_OUT_AMOUNTS" in self.patterns
+
     @property
     def has_velocity(self):
         return self.per_period is not None
@@ -322,56 +360,45 @@ class ApprovalRule:
 
         return rv
 
-    def matches_transaction(self, psbt, users, total_out, local_oked, chain):
-        # Does this rule apply to this PSBT file? 
+    def matches_transaction(self, facts, users, local_oked, chain):
+        # Does this rule apply to this PSBT file? Decided from facts gathered already.
         if self.wallet:
             # rule limited to one wallet
-            if psbt.active_multisig:
+            if facts.multisig is not None:
                 # if multisig signing, might need to match specific wallet name
-                assert self.wallet == psbt.active_multisig.name, 'wrong wallet'
+                assert self.wallet == facts.multisig, 'wrong wallet'
             else:
                 # non multisig, but does this rule apply to all wallets or single-singers
                 assert self.wallet == '1', 'not multisig'
 
+        total_out = facts.total_out
+
         if self.max_amount is not None:
             assert total_out <= self.max_amount, 'amount exceeded'
 
-        attest_mode = self.whitelist_opts and self.whitelist_opts.attest
-        allow_zeroval = self.whitelist_opts and self.whitelist_opts.allow_zeroval_outs
-
         # check all destinations are in the whitelist if mode is basic
-        if self.whitelist and not attest_mode:
-            dests = set()
-            for idx, txo in psbt.output_iter():
-                o = psbt.outputs[idx]
-                if o.is_change or (txo.nValue == 0 and allow_zeroval):
-                    continue
-
-                try:
-                    address = chain.render_address(txo.scriptPubKey)
-                except ValueError:
-                    address = str(b2a_hex(txo.scriptPubKey), 'ascii')
+        if self.whitelist and not self.attest_mode:
+            wl = self.whitelist_scripts
+            for script in facts.dests:
+                assert script in wl, "non-whitelisted address: " + render_dest(chain, script)
 
-                dests.add(address)
-
-            diff = dests - set(self.whitelist)
-            assert not diff, "non-whitelisted address: " + diff.pop()
+            if not self.allow_zeroval:
+                for script in facts.zeroval_dests:
+                    assert script in wl, \
+                                "non-whitelisted address: " + render_dest(chain, script)
 
         # check all foreign outputs are attested if mode is attest
-        if self.whitelist and attest_mode:
-            for idx, txo in psbt.output_iter():
-                o = psbt.outputs[idx]
-                if o.is_change or (txo.nValue == 0 and allow_zeroval):
+        if self.whitelist and self.attest_mode:
+            for idx, nValue, ver_addr, problem in facts.attested:
+                if nValue == 0 and self.allow_zeroval:
                     continue
-                assert o.attestation, "missing attestation for output %i" % idx
-                # we are verifying the whole consensus-encoded txout
-                txo_bytes = CTxOut(txo.nValue, txo.scriptPubKey).serialize()
-                digest = chain.hash_message(txo_bytes)
-                addr_fmt, pubkey = chains.verify_recover_pubkey(o.attestation, digest)
+                if problem:
+                    raise ValueError(problem)
+                assert ver_addr, "missing attestation for output %i" % idx
                 # we have extracted a valid pubkey from the sig, but is it
                 # a whitelisted pubkey or something else?
-                ver_addr = chain.pubkey_to_address(pubkey, addr_fmt)
-                assert ver_addr in self.whitelist, 'non-whitelisted attestation key for output %i' % idx
+                assert ver_addr in self.whitelist_set, \
+                            'non-whitelisted attestation key for output %i' % idx
 
         if self.local_conf:
             # local user must approve
@@ -390,80 +417,265 @@ class ApprovalRule:
 
         # check the self-transfer percentage
         if self.min_pct_self_transfer:
-            own_in_value = sum([i.amount for i in psbt.inputs if i.num_our_keys])
-            own_out_value = 0
-            for idx, txo in psbt.output_iter():
-                o = psbt.outputs[idx]
-                if o.num_our_keys:
-                    own_out_value += txo.nValue
-            percentage = (float(own_out_value) / own_in_value) * 100.0
+            percentage = (float(facts.own_out_value) / facts.own_in_value) * 100.0
             assert percentage >= self.min_pct_self_transfer, 'does not meet self transfer threshold, expected: %.2f, actual: %.2f' % (self.min_pct_self_transfer, percentage)
 
         # check various patterns
 
-        if "EQ_NUM_INS_OUTS" in self.patterns:
-            assert len(psbt.inputs) == len(psbt.outputs), 'unequal number of inputs and outputs'
+        if self.eq_num_ins_outs:
+            assert facts.num_ins == facts.num_outs, 'unequal number of inputs and outputs'
 
-        if "EQ_NUM_OWN_INS_OUTS" in self.patterns:
-            own_ins = sum([1 for i in psbt.inputs if i.num_our_keys])
-            own_outs = sum([1 for o in psbt.outputs if o.num_our_keys])
-            assert own_ins == own_outs, 'unequal number of own inputs and outputs'
+        if self.eq_num_own_ins_outs:
+            assert facts.own_ins == facts.own_outs, 'unequal number of own inputs and outputs'
 
-        if "EQ_OUT_AMOUNTS" in self.patterns:
-            _, txo = next(psbt.output_iter())
-            wanted = txo.nValue
-            for _, txo in psbt.output_iter():
-                assert txo.nValue == wanted, 'not all output amounts are equal'
+        if self.eq_out_amounts:
+            assert facts.eq_amounts, 'not all output amounts are equal'
 
         return True
 
+class TxnFacts:
+    # What approval rules need to know about a transaction, gathered in one
+    # pass over inputs and outputs, however many rules there are.
+    # - destination scripts kept only if some rule has a whitelist,
+    #   and attestations checked only if some rule wants them
+    def __init__(self, psbt, chain, need_dests=False, need_attest=False):
+        ms = psbt.active_multisig
+        self.multisig = ms.name if ms else None
+
+        self.num_ins = len(psbt.inputs)
+        self.num_outs = len(psbt.outputs)
+
+        self.own_ins = 0
+        self.own_in_value = 0
+        for i in psbt.inputs:
+            if i.num_our_keys:
+                self.own_ins += 1
+                self.own_in_value += i.amount
+
+        self.total_out = 0          # to foreign outputs
+        self.own_outs = 0
+        self.own_out_value = 0
+        self.eq_amounts = True
+        self.dests = set()          # foreign scriptPubKeys, w/ non-zero value
+        self.zeroval_dests = set()  # .. and w/ zero value
+        self.attested = []          # (idx, value, attested address, problem) for foreign
+
+        first = None
+        for idx, txo in psbt.output_iter():
+            o = psbt.outputs[idx]
+
+            if first is None:
+                first = txo.nValue
+            elif txo.nValue != first:
+                self.eq_amounts = False
+
+            if o.num_our_keys:
+                self.own_outs += 1
+                self.own_out_value += txo.nValue
+
+            if o.is_change:
+                continue
+
+            self.total_out += txo.nValue
+
+            if need_dests:
+                (self.dests if txo.nValue else self.zeroval_dests).add(txo.scriptPubKey)
+
+            if need_attest:
+                ver_addr = problem = None
+                if o.attestation:
+                    try:
+                        # we are verifying the whole consensus-encoded txout
+                        txo_bytes = CTxOut(txo.nValue, txo.scriptPubKey).serialize()
+                        digest = chain.hash_message(txo_bytes)
+                        addr_fmt, pubkey = chains.verify_recover_pubkey(o.attestation, digest)
+                        ver_addr = chain.pubkey_to_address(pubkey, addr_fmt)
+                    except Exception as exc:
+                        # only a problem for rules that need it
+                        problem = str(exc) or problem_file_line(exc)
+
+                self.attested.append((idx, txo.nValue, ver_addr, problem))
+
+class AuditLogWriter:
+    # Writes audit log entries to MicroSD, in batches.
+    # - card stays mounted between requests, rather than mount/unmount for each;
+    #   but not the virtual disk, since USB (our only control) is off while it is
+    # - entries wait in memory until LOG_FLUSH_MS or LOG_FLUSH_BYTES, unless
+    #   caller needs it on the card now (must_log, before approving)
+    # - written strictly in order, each entry numbered; entries are forgotten
+    #   as soon as their file is closed, so none are written twice
+    def __init__(self):
+        self.card = None
+        self.dirs = set()           # made already, this mount
+        self.pending = []           # (fname, text), oldest first
+        self.pending_len = 0
+        self.dropped = 0            # entries lost because card couldn't be written
+        self.seq = 0
+        self.timer = False
+
+    def open(self):
+        # mount card, if not already done; false if we can't
+        if self.card and not CardSlot.is_inserted():
+            # card pulled out: start over when it comes back
+            self.close()
+
+        if not self.card:
+            try:
+                self.card = CardSlot().__enter__()
+                self.dirs.clear()
+            except (CardMissingError, OSError):
+                self.card = None
+
+        return bool(self.card)
+
+    def close(self):
+        # unmount; pending entries kept for when card is back
+        if self.card:
+            try:
+                self.card.__exit__(None, None, None)
+            except BaseException as exc:
+                sys.print_exception(exc)
+            self.card = None
+
+    def release(self):
+        # unmount, if it's the virtual disk
+        if self.card and self.card.mountpt != self.card.get_sd_root():
+            self.close()
+
+    def next_seq(self):
+        self.seq += 1
+        return self.seq
+
+    def add(self, dirname, digest, text, durable=False):
+        # queue text to be appended to log file for this request
+        fname = dirname + '/' + b2a_hex(digest[-8:]).decode('ascii') + '.log'
+        self.pending.append((fname, text))
+        self.pending_len += len(text)
+
+        if durable:
+            try:
+                self.flush()
+            except OSError:
+                # not on card: take it back, caller still has it
+                self.pending_len -= len(self.pending.pop()[1])
+                raise
+        elif self.pending_len >= LOG_FLUSH_BYTES:
+            try:
+                self.flush()
+            except OSError as exc:
+                # keep them for next time, within reason
+                sys.print_exception(exc)
+                while self.pending_len > LOG_MAX_PENDING:
+                    self.pending_len -= len(self.pending.pop(0)[1])
+                    self.dropped += 1
+        elif not self.timer:
+            from utils import call_later_ms
+            self.timer = True
+            call_later_ms(LOG_FLUSH_MS, self.flush_later)
+
+    async def flush_later(self):
+        self.timer = False
+        try:
+            self.flush()
+        except BaseException as exc:
+            # keep them for next time
+            sys.print_exception(exc)
+
+    def flush(self):
+        # write all pending entries, in order; raise if that can't be done
+        if not self.pending:
+            return
+
+        if not self.open():
+            raise OSError('no card')
+
+        if self.dropped:
+            # next file written says so
+            fn, text = self.pending[0]
+            note = '(%d log entries lost: could not write card)\n\n' % self.dropped
+            self.pending[0] = (fn, note + text)
+            self.pending_len += len(note)
+            self.dropped = 0
+
+        try:
+            root = self.card.get_sd_root() + '/'
+            while self.pending:
+                # consecutive entries for same file are one write
+                fname = self.pending[0][0]
+                count = 1
+                while count < len(self.pending) and self.pending[count][0] == fname:
+                    count += 1
+
+                d = fname.split('/')[0]
+                if d not in self.dirs:
+                    # mkdir if needed
+                    try: uos.stat(root + d)
+                    except: uos.mkdir(root + d)
+                    self.dirs.add(d)
+
+                with open(root + fname, 'at') as fd:      # append mode
+                    for i in range(count):
+                        fd.write(self.pending[i][1])
+
+                # on card now; forget them
+                for i in range(count):
+                    self.pending_len -= len(self.pending.pop(0)[1])
+        except OSError:
+            # card likely gone or unmounted under us
+            self.close()
+            raise
+
+        self.release()
+
 class AuditLogger:
-    def __init__(self, dirname, digest, never_log):
+    # Collects the log entry for one request. Text goes to the writer when
+    # done, or sooner if commit() is called.
+    def __init__(self, writer, dirname, digest, never_log):
+        self.writer = writer
         self.dirname = dirname
         self.digest = digest
         self.never_log = never_log
 
     def __enter__(self):
-        try:
-            if self.never_log:
-                raise NotImplementedError
-
-            self.card = CardSlot().__enter__()
-
-            d = self.card.get_sd_root() + '/' + self.dirname
-
-            # mkdir if needed
-            try: uos.stat(d)
-            except: uos.mkdir(d)
-                
-            self.fname = d + '/' + b2a_hex(self.digest[-8:]).decode('ascii') + '.log'
-            self.fd = open(self.fname, 'a+t')       # append mode
-        except (CardMissingError, OSError, NotImplementedError):
-            # may be fatal or not, depending on configuration
-            self.fname = self.card = None
-            self.fd = sys.stdout
-
+        # may be fatal or not, depending on configuration
+        self.unsaved = self.never_log or not self.writer.open()
+        self.writer.release()
+        self.lines = ['Entry #%d' % self.writer.next_seq()]
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
         if exc_value:
-            self.fd.write('\n\n---- Coldcard Exception ----\n')
-            sys.print_exception(exc_value, self.fd)
+            self.lines.append('\n\n---- Coldcard Exception ----')
+            fd = uio.StringIO()
+            sys.print_exception(exc_value, fd)
+            self.lines.append(fd.getvalue())
 
-        self.fd.write('\n===\n\n')
+        self.lines.append('\n===\n')
 
-        if self.card:
-            assert self.fd != sys.stdout
-            self.fd.close()
-            self.card.__exit__(exc_type, exc_value, traceback)
+        try:
+            self.commit(False)
+        except OSError:
+            # too late to matter for this request
+            pass
+
+    def commit(self, durable=True):
+        # send what we have so far to the writer; maybe onto card right now
+        # - if that fails, lines are kept
+        text = '\n'.join(self.lines) + '\n'
+
+        if self.unsaved:
+            print(text, end='')
+        else:
+            self.writer.add(self.dirname, self.digest, text, durable)
+
+        self.lines.clear()
 
     @property
     def is_unsaved(self):
-        return not self.card
+        return self.unsaved
 
     def info(self, msg):
-        print(msg, file=self.fd)
-        #if self.fd != sys.stdout: print(msg)
+        self.lines.append(msg)
 
 class HSMPolicy:
     # implements and enforces the HSM signing/activity/logging policy
@@ -488,6 +700,12 @@ class HSMPolicy:
         # storage locker value hash
         self.sl_hash = None
 
+        # card stays mounted while we're active
+        self.log_writer = AuditLogWriter()
+
+        # user secrets, decoded once; wiped when we stop
+        self.user_auth = UserAuthCache()
+
     def load(self, j):
         # Decode json object provided: destructive
         # - attr name == json name if possible
@@ -779,7 +997,7 @@ class HSMPolicy:
         # Maybe approve indicated message to be signed.
         # return 'y' or 'x'
         sha = ngu.hash.sha256s(msg_text)
-        with AuditLogger('messages', sha, self.never_log) as log:
+        with AuditLogger(self.log_writer, 'messages', sha, self.never_log) as log:
 
             if self.must_log and log.is_unsaved:
                 self.refuse(log, "Could not log details, and must_log is set")
@@ -798,7 +1016,8 @@ class HSMPolicy:
                 self.refuse(log, 'Message signing not enabled for that path')
                 return 'x'
 
-            self.approve(log, 'Message signing allowed')
+            if not self.approve(log, 'Message signing allowed'):
+                return 'x'
 
         return 'y'
 
@@ -863,15 +1082,16 @@ class HSMPolicy:
         from ubinascii import b2a_base64
         self.next_local_code = b2a_base64(ngu.random.bytes(15)).strip().decode('ascii')
 
-    async def approve_transaction(self, psbt, psbt_sha, story):
+    async def approve_transaction(self, psbt, psbt_sha, story, auth=None):
         # Approve or don't a transaction. Catch assertions and other
         # reasons for failing/rejecting into the log.
+        # - auth: user approvals captured when txn was queued, else pending ones used
         # - return 'y' or 'x'
         chain = chains.current_chain()
         assert psbt_sha and len(psbt_sha) == 32
         self.get_time_left()
 
-        with AuditLogger('psbt', psbt_sha, self.never_log) as log:
+        with AuditLogger(self.log_writer, 'psbt', psbt_sha, self.never_log) as log:
 
             if self.must_log and log.is_unsaved:
                 self.refuse(log, "Could not log details, and must_log is set")
@@ -881,9 +1101,10 @@ class HSMPolicy:
             log.info('SHA256(PSBT) = ' + b2a_hex(psbt_sha).decode('ascii'))
             log.info('-vvv-\n%s\n-^^^-' % story)
 
-            # reset pending auth list and "consume" it now
-            auth = self.pending_auth
-            self.pending_auth = {}
+            if auth is None:
+                # reset pending auth list and "consume" it now
+                auth = self.pending_auth
+                self.pending_auth = {}
 
             try:
                 # do this super early so always cleared even if other issues
@@ -901,12 +1122,17 @@ class HSMPolicy:
 
                 # See who has entered creditials already (all must be valid).
                 users = []
-                for u, (token, counter) in auth.items():
-                    problem = Users.auth_okay(u, token, totp_time=counter, psbt_hash=psbt_sha)
-                    if problem:
-                        self.refuse(log, "User '%s' gave wrong auth value: %s" % (u, problem))
-                        return 'x'
-                    users.append(u)
+                try:
+                    for u, (token, counter) in auth.items():
+                        problem = self.user_auth.check(u, token, totp_time=counter,
+                                                            psbt_hash=psbt_sha)
+                        if problem:
+                            self.refuse(log, "User '%s' gave wrong auth value: %s" % (u, problem))
+                            return 'x'
+                        users.append(u)
+                finally:
+                    # codes used are used up: one settings write for all users
+                    self.user_auth.save()
 
                 # was right code provided locally? (also resets for next attempt)
                 if local_ok:
@@ -914,18 +1140,17 @@ class HSMPolicy:
                 if users:
                     log.info("These users gave correct auth codes: " + ', '.join(users))
 
-                # Totals (applies to foreign)
-                total_out = 0
-                for idx, txo in psbt.output_iter():
-                    outp = psbt.outputs[idx]
-                    if not outp.is_change:
-                        total_out += txo.nValue
+                # Totals (applies to foreign), and everything else rules look at
+                facts = TxnFacts(psbt, chain,
+                            need_dests=any(r.whitelist and not r.attest_mode for r in self.rules),
+                            need_attest=any(r.whitelist and r.attest_mode for r in self.rules))
+                total_out = facts.total_out
 
                 # Pick a rule to apply to this specific txn
                 reasons = []
                 for rule in self.rules:
                     try:
-                        if rule.matches_transaction(psbt, users, total_out, local_ok, chain):
+                        if rule.matches_transaction(facts, users, local_ok, chain):
                             break
                     except BaseException as exc:
                         # let's not share these details, except for debug; since
@@ -944,7 +1169,8 @@ class HSMPolicy:
                         msg += ', and the local operator.' if msg else 'local operator'
 
                 # looks good, do it
-                self.approve(log, "Acceptable by rule #%d" % rule.index)
+                if not self.approve(log, "Acceptable by rule #%d" % rule.index):
+                    return 'x'
 
                 if rule.per_period is not None:
                     self.record_spend(rule, total_out)
@@ -965,15 +1191,37 @@ class HSMPolicy:
         
         # Crash if too many refusals happen.
         if self.refusals >= ABSOLUTE_MAX_REFUSALS:
-            from utils import clean_shutdown, call_later_ms
-            call_later_ms(250, clean_shutdown)
+            from utils import call_later_ms
+            call_later_ms(250, self.shutdown)
+
+    async def shutdown(self):
+        # save any log entries still waiting, if we can, then stop
+        from utils import clean_shutdown
+        try:
+            self.log_writer.flush()
+        except BaseException:
+            pass
+        clean_shutdown()
 
     def approve(self, log, msg):
-        # when things fail
+        # when things go well
         log.info("\nAPPROVED: " + msg)
+
+        if self.must_log:
+            # entry must be on the card before we go ahead
+            try:
+                log.commit()
+            except OSError:
+                # not approved after all
+                log.lines.pop()
+                self.refuse(log, "Could not log details, and must_log is set")
+                return False
+
         self.approvals += 1
         self.last_refusal = None
 
+        return True
+
 
 def hsm_status_report():
     # Return a JSON-able object. Documented and external programs
@@ -1001,6 +1249,11 @@ def hsm_status_report():
     if hsm_active:
         hsm_active.status_report(rv)
 
+    import phases
+    if phases.enabled():
+        # dev/simulator only: phase timings of most recent PSBT signed
+        rv['phase_timing'] = phases.last_report()
+
     return rv
 
 def hash_policy_field(hasher, value):
@@ -9,7 +9,7 @@ from sffile import SFFile
 from ux import ux_show_story, abort_and_goto
 from ux import AbortInteraction
 from utils import problem_file_line
-from auth import UserAuthorizedAction
+from auth import UserAuthorizedAction, QueuedTransaction
 from queues import QueueEmpty
 
 
@@ -365,10 +365,29 @@ class hsmUxInteraction:
                 except AbortInteraction:
                     pass
 
+            # queued transactions: sign them all, back-to-back
+            job = QueuedTransaction.next_job()
+            while job:
+                try:
+                    await job.interact()
+                except AbortInteraction:
+                    pass
+
+                # let USB have a turn: host uploads next one, collects this one
+                await sleep_ms(0)
+                job = QueuedTransaction.next_job()
+
         # This code only reachable on the simulator and modified devices under test,
         # and when the "boot_to_hsm" feature is used and successfully unlock near
         # boottime.
         from actions import goto_top_menu
+        try:
+            glob.hsm_active.log_writer.flush()
+        except BaseException:
+            pass
+        glob.hsm_active.log_writer.close()
+        glob.hsm_active.user_auth.wipe()
+        QueuedTransaction.clear_queue()
         glob.hsm_active = None
         goto_top_menu()
 
@@ -31,6 +31,7 @@ freeze_as_mpy('', [
 	'nvstore.py',
 	'opcodes.py',
 	'paper.py',
+	'phases.py',
 	'pincodes.py',
 	'psbt.py',
 	'pwsave.py',
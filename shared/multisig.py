@@ -22,6 +22,9 @@ TRUST_VERIFY = const(0)
 TRUST_OFFER = const(1)
 TRUST_PSBT = const(2)
 
+# Max number of parsed/derived co-signer nodes kept per wallet object
+MAX_NODE_CACHE = const(64)
+
 
 class MultisigOutOfSpace(RuntimeError):
     pass
@@ -84,28 +87,52 @@ def disassemble_multisig(redeem_script):
 
     return M, N, pubkeys
 
+class RedeemScriptMaker:
+    # Make standard M-of-N redeem scripts for a run of subkey indexes.
+    # - nodes are the per-cosigner branch nodes, never modified here
+    # - script built in a preallocated buffer: fixed opcodes written once,
+    #   pubkeys written in place for each index
+    def __init__(self, M, nodes, bip67=True):
+        N = len(nodes)
+        assert 1 <= M <= N <= MAX_SIGNERS
+
+        self.nodes = nodes
+        self.bip67 = bip67
+        self.pubkeys = [None] * N
+
+        self.buf = bytearray(1 + (34 * N) + 2)
+        self.buf[0] = 80 + M
+        for i in range(N):
+            # 0x21 = 33 = len(pubkey) = OP_PUSHDATA(33)
+            self.buf[1 + (34 * i)] = 0x21
+        self.buf[-2] = 80 + N
+        self.buf[-1] = OP_CHECKMULTISIG
+
+    def make(self, subkey_idx):
+        # derive subkey_idx of each node; returns shared buffer, valid until next call
+        pubkeys = self.pubkeys
+        for i, n in enumerate(self.nodes):
+            copy = n.copy()
+            copy.derive(subkey_idx, False)
+            pubkeys[i] = copy.pubkey()
+            del copy
+
+        if self.bip67:
+            # same order as sorting w/ PUSHDATA prefix, since all are 33 bytes
+            pubkeys.sort()
+
+        buf = self.buf
+        pos = 2
+        for pk in pubkeys:
+            buf[pos:pos+33] = pk
+            pos += 34
+
+        return buf
+
 def make_redeem_script(M, nodes, subkey_idx, bip67=True):
     # take a list of BIP-32 nodes, and derive Nth subkey (subkey_idx) and make
     # a standard M-of-N redeem script for that. Applies BIP-67 sorting by default.
-    N = len(nodes)
-    assert 1 <= M <= N <= MAX_SIGNERS
-
-    pubkeys = []
-    for n in nodes:
-        copy = n.copy()
-        copy.derive(subkey_idx, False)
-        # 0x21 = 33 = len(pubkey) = OP_PUSHDATA(33)
-        pubkeys.append(b'\x21' + copy.pubkey())
-        del copy
-
-    if bip67:
-        pubkeys.sort()
-
-    # serialize redeem script
-    pubkeys.insert(0, bytes([80 + M]))
-    pubkeys.append(bytes([80 + N, OP_CHECKMULTISIG]))
-
-    return b''.join(pubkeys)
+    return bytes(RedeemScriptMaker(M, nodes, bip67).make(subkey_idx))
 
 class MultisigWallet(WalletABC):
     # Capture the info we need to store long-term in order to participate in a
@@ -128,6 +155,9 @@ class MultisigWallet(WalletABC):
     # optional: user can short-circuit many checks (system wide, one power-cycle only)
     disable_checks = False
 
+    # index over saved wallets, built on demand: see registry()
+    _registry = None
+
     def __init__(self, name, m_of_n, xpubs, addr_fmt=AF_P2SH, chain_type='BTC', bip67=True):
         self.storage_idx = -1
 
@@ -147,6 +177,9 @@ class MultisigWallet(WalletABC):
 
         assert len(self.xfp_paths) == self.N, 'dup XFP'         # not supported
 
+        # (xp_idx, branch) => node; lives as long as this object (one signing session)
+        self.node_cache = {}
+
     @classmethod
     def render_addr_fmt(cls, addr_fmt):
         for k, v in cls.FORMAT_NAMES:
@@ -239,12 +272,54 @@ class MultisigWallet(WalletABC):
         return rv
 
     @classmethod
-    def iter_wallets(cls, M=None, N=None, not_idx=None, addr_fmt=None):
+    def registry(cls):
+        # Index of saved wallets, so lookups need not deserialize all of them.
+        # - returns (lst, len, set of (M, N, XOR of xfps), sorted xfps => [storage idx])
+        # - rebuilt when list changes under us: commit/delete, or another seed's settings
+        lst = settings.get('multisig', [])
+        reg = cls._registry
+        if reg and reg[0] is lst and reg[1] == len(lst):
+            return reg
+
+        by_mnx = set()
+        by_xfps = {}
+        for idx, rec in enumerate(lst):
+            M, N = tuple(rec[1])
+            xfps = tuple(sorted(x[0] for x in rec[2]))
+            xor = 0
+            for xfp in xfps:
+                xor ^= xfp
+            by_mnx.add((M, N, xor))
+            by_xfps.setdefault(xfps, []).append(idx)
+
+        cls._registry = reg = (lst, len(lst), by_mnx, by_xfps)
+        return reg
+
+    @classmethod
+    def invalidate_registry(cls):
+        cls._registry = None
+
+    @classmethod
+    def xfp_candidates(cls, xfp_paths):
+        # storage indexes of wallets using exactly the xfp values of xfp_paths,
+        # or None if all wallets must be considered
+        xfps = [x[0] for x in xfp_paths]
+        if len(set(xfps)) != len(xfps):
+            # dup XFP in request: rare, and matching_subpaths can still
+            # accept it, so search them all
+            return None
+
+        return cls.registry()[3].get(tuple(sorted(xfps)), ())
+
+    @classmethod
+    def iter_wallets(cls, M=None, N=None, not_idx=None, addr_fmt=None, only_idx=None):
         # yield MS wallets we know about, that match at least right M,N if known.
         # - this is only place we should be searching this list, please!!
+        # - only_idx: storage indexes to consider, typically from registry()
         lst = settings.get('multisig', [])
 
-        for idx, rec in enumerate(lst):
+        for idx in (range(len(lst)) if only_idx is None else only_idx):
+            rec = lst[idx]
             if idx == not_idx:
                 # ignore one by index
                 continue
@@ -272,7 +347,8 @@ class MultisigWallet(WalletABC):
         # - xfp_paths is list of lists: [xfp, *path] like in psbt files
         # - M and N must be known
         # - returns instance, or None if not found
-        for rv in cls.iter_wallets(M, N, addr_fmt=addr_fmt):
+        only = cls.xfp_candidates(xfp_paths)
+        for rv in cls.iter_wallets(M, N, addr_fmt=addr_fmt, only_idx=only):
             if rv.matching_subpaths(xfp_paths):
                 return rv
 
@@ -288,7 +364,8 @@ class MultisigWallet(WalletABC):
         N = len(xfp_paths)
         
         matches = []
-        for rv in cls.iter_wallets(M=M, addr_fmt=addr_fmt):
+        only = cls.xfp_candidates(xfp_paths)
+        for rv in cls.iter_wallets(M=M, addr_fmt=addr_fmt, only_idx=only):
             if rv.matching_subpaths(xfp_paths):
                 matches.append(rv)
 
@@ -332,16 +409,7 @@ class MultisigWallet(WalletABC):
     @classmethod
     def quick_check(cls, M, N, xfp_xor):
         # quicker? USB method.
-        rv = []
-        for ms in cls.iter_wallets(M, N):
-            x = 0
-            for xfp in ms.xfp_paths.keys():
-                x ^= xfp
-            if x != xfp_xor: continue
-
-            return True
-
-        return False
+        return (M, N, xfp_xor) in cls.registry()[2]
 
     @classmethod
     def get_all(cls):
@@ -380,6 +448,7 @@ class MultisigWallet(WalletABC):
             v[self.storage_idx] = obj
 
         settings.set('multisig', v)
+        self.invalidate_registry()
 
         # save now, rather than in background, so we can recover
         # from out-of-space situation
@@ -389,6 +458,7 @@ class MultisigWallet(WalletABC):
             # back out change; no longer sure of NVRAM state
             try:
                 settings.set('multisig', orig)
+                self.invalidate_registry()
                 settings.save()
             except: pass        # give up on recovery
 
@@ -460,6 +530,7 @@ class MultisigWallet(WalletABC):
             settings.set('multisig', lst)
         else:
             settings.remove_key('multisig')
+        self.invalidate_registry()
         settings.save()
 
         self.storage_idx = -1
@@ -479,28 +550,50 @@ class MultisigWallet(WalletABC):
         # setup
         nodes = []
         paths = []
-        for xfp, deriv, xpub in self.xpubs:
-            # load bip32 node for each cosigner
-            node = ch.deserialize_node(xpub, AF_P2SH)
-            node.derive(change_idx, False)
+        for xp_idx, (xfp, deriv, xpub) in enumerate(self.xpubs):
+            # bip32 node for each cosigner's branch (shared, cached)
+            nodes.append(self.cosigner_node(xp_idx, (change_idx,)))
             # indicate path used (for UX)
             path = "[%s/%s/%d/{idx}]" % (xfp2str(xfp), deriv[2:], change_idx)
-            nodes.append(node)
             paths.append(path)
 
+        maker = RedeemScriptMaker(self.M, nodes, self.bip67)
+
         idx = start_idx
         while count:
             if idx > MAX_BIP32_IDX:
                 break
             # make the redeem script, convert into address
-            script = make_redeem_script(self.M, nodes, idx, self.bip67)
+            script = maker.make(idx)
             addr = ch.p2sh_address(self.addr_fmt, script)
 
-            yield idx, addr, [p.format(idx=idx) for p in paths], script
+            yield idx, addr, [p.format(idx=idx) for p in paths], bytes(script)
 
             idx += 1
             count -= 1
 
+    def cosigner_node(self, xp_idx, branch=()):
+        # Parse co-signer's xpub and derive (non-hardened) branch below it.
+        # - cached, so a branch shared by many inputs/outputs is derived just once
+        # - returned node is shared: copy it before deriving any further
+        key = (xp_idx, branch)
+        node = self.node_cache.get(key)
+        if node is not None:
+            return node
+
+        if branch:
+            node = self.cosigner_node(xp_idx, branch[:-1]).copy()
+            node.derive(branch[-1], False)     # works in-place
+        else:
+            node = self.chain.deserialize_node(self.xpubs[xp_idx][-1], AF_P2SH); assert node
+
+        if len(self.node_cache) >= MAX_NODE_CACHE:
+            # unusual path patterns; start over rather than grow without limit
+            self.node_cache.clear()
+        self.node_cache[key] = node
+
+        return node
+
     def validate_script(self, redeem_script, subpaths=None, xfp_paths=None):
         # Check we can generate all pubkeys in the redeem script, raise on errors.
         # - working from pubkeys in the script, because duplicate XFP can happen
@@ -512,7 +605,6 @@ class MultisigWallet(WalletABC):
 
         subpath_help = []
         used = set()
-        ch = self.chain
 
         M, N, pubkeys = disassemble_multisig(redeem_script)
         assert M==self.M and N == self.N, 'wrong M/N in script'
@@ -551,9 +643,7 @@ class MultisigWallet(WalletABC):
                     assert xp_idx == pk_order, "script key order"
 
                 # matched fingerprint, try to make pubkey that needs to match
-                xpub = self.xpubs[xp_idx][-1]
-
-                node = ch.deserialize_node(xpub, AF_P2SH); assert node
+                node = self.cosigner_node(xp_idx)
                 dp = node.depth()
 
                 #print("%s => deriv=%s dp=%d len(path)=%d path=%s" %
@@ -567,7 +657,11 @@ class MultisigWallet(WalletABC):
 
                 for sp in path[dp:]:
                     assert not (sp & 0x80000000), 'hard deriv'
-                    node.derive(sp, False)     # works in-place
+
+                if dp < len(path):
+                    # only the leaf is unique to this script; branch above it is cached
+                    node = self.cosigner_node(xp_idx, tuple(path[dp:-1])).copy()
+                    node.derive(path[-1], False)
 
                 found_pk = node.pubkey()
 
@@ -63,6 +63,9 @@ from utils import call_later_ms
 #   ptxurl = (str) URL for PushTx feature, clear to disable feature
 #   hmx    = (bool) Force display of current XFP in home menu, even w/o tmp seed active
 #   unsort_ms = (bool) Allow unsorted multisig with BIP-67 disabled
+#   aocd = (int) address ownership cache depth, per wallet branch (default 764)
+#   aohl = (int) address ownership cache record length, in bytes (default 2)
+#   aobg = (bool) build address ownership caches in background, when idle
 
 # Stored w/ key=00 for access before login
 #   _skip_pin = hard code a PIN value (dangerous, only for debug)
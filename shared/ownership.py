@@ -2,7 +2,7 @@
 #
 # ownership.py - store a cache of hashes related to addresses we might control.
 #
-import os, sys, chains, ngu, struct, version
+import os, sys, chains, ngu, struct, version, utime
 from glob import settings
 from ucollections import namedtuple
 from ubinascii import hexlify as b2a_hex
@@ -23,38 +23,96 @@ from exceptions import UnknownAddressExplained
 # - searching leaves behind a cache for next time
 # - data building/saves happens when are searching, but might grab some during addr expl export?
 # - performance: 1m40s for one P2PKH wallet (change, and external addresses: 1528 in all)
+# - small Bloom filter ahead of the records: most files can be ruled out w/o reading records
+# - deeper caches (setting) use more segment files per branch, searched in order
+# - lists of addresses (USB or file) are searched together: one read of each file
 #
 
-# length of hashed & truncated address record
+# length of hashed & truncated address record: default, and longest allowed ('aohl')
 HASH_ENC_LEN = const(2)
+MAX_HASH_ENC_LEN = const(8)
 
 # File header
 OwnershipFileHdr = namedtuple('OwnershipFileHdr', 'file_magic change_idx flags')
 OWNERSHIP_FILE_HDR = 'HHI'
 OWNERSHIP_FILE_HDR_LEN = 8
 
-OWNERSHIP_MAGIC = 0x10A0            # "Address Ownership" v1.0
-# flags: none yet, but 32 bits reserved
+OWNERSHIP_MAGIC = 0x10A1            # "Address Ownership" v1.1: header, bloom, records
+OWNERSHIP_MAGIC_V1 = 0x10A0         # v1.0: header, records; still searched, then replaced
+# flags: low byte is record length (zero means HASH_ENC_LEN); rest reserved
+FLAG_HASH_LEN_MASK = const(0xff)
 
-# target 3 flash blocks, max file size => 764 addresses
-MAX_ADDRS_STORED = const(764)       # =((3*512) - OWNERSHIP_FILE_HDR_LEN) // HASH_ENC_LEN
+# Bloom filter: bit positions come from digest bytes that are not stored in records
+BLOOM_LEN = const(256)              # bytes
+BLOOM_HASHES = const(2)
+
+# Each wallet branch is stored as one or more segment files, each holding SEG_ADDRS.
+# - records for 3 flash blocks, plus one for header and bloom filter => 764 addresses
+# - (at default record length; longer records make bigger segment files)
+SEG_ADDRS = const(764)              # =((3*512) - OWNERSHIP_FILE_HDR_LEN) // HASH_ENC_LEN
+
+# Addresses cached per branch: default is a single segment, can be raised w/ 'aocd'
+MAX_ADDRS_STORED = const(764)
+MAX_CACHE_DEPTH = const(30560)      # =40 segments
 BONUS_GAP_LIMIT = const(20)
 
+# Generating addresses for several wallets: how many to do per turn, and how much
+# memory all the in-progress segments (plus wallet/generator state) may use
+BUILD_CHUNK = const(20)
+BUILDER_OVERHEAD = const(1024)
+PHASE2_MEM_BUDGET = const(16384)
+
+# Background pre-warming ('aobg' setting): only after this long w/o keypresses, at a
+# menu; few addresses per turn, so UX and USB are never kept waiting long
+PREWARM_IDLE_MS = const(30000)
+PREWARM_POLL_MS = const(5000)
+PREWARM_CHUNK = const(4)
+
+# Batch verification: most addresses in one list (file or USB upload)
+MAX_BATCH_ADDRS = const(1000)
+
+def cache_depth():
+    # how many addresses to cache, per wallet branch
+    return max(1, min(settings.get('aocd', MAX_ADDRS_STORED), MAX_CACHE_DEPTH))
+
+def cache_hash_len():
+    # record length for new segments; existing segments keep what they have
+    return max(HASH_ENC_LEN, min(settings.get('aohl', HASH_ENC_LEN), MAX_HASH_ENC_LEN))
+
 def encode_addr(addr, salt):
     # Convert text address to something we can store while preserving privacy.
-    return ngu.hash.sha256s(salt + addr)[0:HASH_ENC_LEN]
+    # - returns full digest: record is first few bytes, next ones feed bloom filter
+    return ngu.hash.sha256s(salt + addr)
+
+def bloom_bits(digest, hash_len=HASH_ENC_LEN):
+    # yield (byte offset, mask) for each bit of this digest in the filter
+    for i in range(BLOOM_HASHES):
+        p = hash_len + (2 * i)
+        n = ((digest[p] << 8) | digest[p+1]) % (BLOOM_LEN * 8)
+        yield n >> 3, 1 << (n & 7)
+
+def data_offset(legacy):
+    # where records start in a segment file
+    if legacy:
+        return OWNERSHIP_FILE_HDR_LEN
+    return OWNERSHIP_FILE_HDR_LEN + BLOOM_LEN
 
 class AddressCacheFile:
+    # Cached address hashes for one branch (external or change) of one wallet.
+    # - held in segment files of SEG_ADDRS records; only the last can be partly full
+    # - appending rewrites just the last segment
 
     def __init__(self, wallet, change_idx):
         self.wallet = wallet
         self.change_idx = change_idx
         desc = wallet.to_descriptor().serialize()
         h = b2a_hex(ngu.hash.sha256d(wallet.chain.ctype + desc))
-        self.fname = h[0:32] + '-%d.own' % change_idx
+        self.fbase = h[0:32]
         self.salt = h[32:]
         self.count = 0
-        self.hdr = None
+        self.segs = []              # (hash_len, count) for each segment on disk
+        self.legacy = False         # v1.0 file, w/o bloom filter nor segments
+        self.depth = cache_depth()
 
         self.peek()
 
@@ -67,73 +125,164 @@ class AddressCacheFile:
     def exists(self):
         return bool(self.count)
 
-    def peek(self):
-        # see what we have on-disk; just reads header.
-        try:
-            with open(self.fname, 'rb') as fd:
-                hdr = fd.read(OWNERSHIP_FILE_HDR_LEN)
-                assert len(hdr) == OWNERSHIP_FILE_HDR_LEN
-                flen = fd.seek(0, 2)
-            self.hdr = OwnershipFileHdr(*struct.unpack(OWNERSHIP_FILE_HDR, hdr))
-            assert self.hdr.file_magic == OWNERSHIP_MAGIC
-            assert self.hdr.change_idx == self.change_idx
-        except OSError:
-            return
-        except Exception as exc:
-            sys.print_exception(exc)
-            self.count = 0
-            self.hdr = None
-            return
+    def seg_fname(self, seg):
+        # first segment keeps the name used before there were segments
+        if not seg:
+            return self.fbase + '-%d.own' % self.change_idx
+        return self.fbase + '-%d-%d.own' % (self.change_idx, seg)
 
-        self.count = (flen - OWNERSHIP_FILE_HDR_LEN) // HASH_ENC_LEN
+    def peek(self):
+        # see what we have on-disk; just reads headers.
+        # - stops at first missing or bad segment; it will be overwritten
+        while True:
+            seg = len(self.segs)
+            try:
+                with open(self.seg_fname(seg), 'rb') as fd:
+                    hdr = fd.read(OWNERSHIP_FILE_HDR_LEN)
+                    assert len(hdr) == OWNERSHIP_FILE_HDR_LEN
+                    flen = fd.seek(0, 2)
+                hdr = OwnershipFileHdr(*struct.unpack(OWNERSHIP_FILE_HDR, hdr))
+                legacy = (hdr.file_magic == OWNERSHIP_MAGIC_V1)
+                assert (legacy and not seg) or hdr.file_magic == OWNERSHIP_MAGIC
+                assert hdr.change_idx == self.change_idx
+            except OSError:
+                return
+            except Exception as exc:
+                sys.print_exception(exc)
+                return
+
+            hl = (hdr.flags & FLAG_HASH_LEN_MASK) or HASH_ENC_LEN
+            n = (flen - data_offset(legacy)) // hl
+
+            self.legacy = legacy
+            self.segs.append((hl, n))
+            self.count += n
+
+            if legacy or n < SEG_ADDRS:
+                # last one
+                return
 
     def setup(self, change_idx, start_idx):
+        # Prepare to add records, following those we have already.
         assert self.change_idx == change_idx
 
-        if self.count or self.hdr:
-            assert start_idx == self.count, 'not an append'
+        if self.legacy:
+            # v1.0 file: start over, since its records are too short
+            # to construct the bloom filter from
+            self.segs = []
+            self.count = 0
+            self.legacy = False
+
+        assert start_idx == self.count, 'not an append'
+
+        if self.segs and self.segs[-1][1] < SEG_ADDRS:
+            # continue partial segment: read it back, to be rewritten w/ additions
+            hl, n = self.segs.pop()
+            self.start_segment(len(self.segs), hl)
 
-            # Open for append, header should be right already
-            self.fd = open(self.fname, 'ab')
+            with open(self.seg_fname(self.seg), 'rb') as fd:
+                fd.seek(OWNERSHIP_FILE_HDR_LEN)
+                fd.readinto(self.bloom)
+                self.records.extend(fd.read(n * hl))
         else:
-            # Start new file
-            assert start_idx == 0
-            self.fd = open(self.fname, 'wb')
-            self.hdr = OwnershipFileHdr(OWNERSHIP_MAGIC, self.change_idx, 0x0)
-            hdr = struct.pack(OWNERSHIP_FILE_HDR, *self.hdr)
-            self.fd.write(hdr)
+            self.start_segment(len(self.segs), cache_hash_len())
+
+    def start_segment(self, seg, hash_len):
+        # build next segment in memory
+        self.seg = seg
+        self.hash_len = hash_len
+        self.records = bytearray()
+        self.bloom = bytearray(BLOOM_LEN)
+
+    def flush(self):
+        # write out segment being built; small, so in one go
+        with open(self.seg_fname(self.seg), 'wb') as fd:
+            fd.write(struct.pack(OWNERSHIP_FILE_HDR, OWNERSHIP_MAGIC,
+                                        self.change_idx, self.hash_len))
+            fd.write(self.bloom)
+            fd.write(self.records)
+
+        self.segs.append((self.hash_len, len(self.records) // self.hash_len))
 
     def append(self, addr):
         if addr is None:
-            # close file, done
-            self.fd.close()
-            del self.fd
+            # done: write out last segment
+            if self.records:
+                self.flush()
+            del self.records, self.bloom
             return
 
         assert '_' not in addr
-        self.fd.write(encode_addr(addr, self.salt))
+        if self.count >= self.depth:
+            # full; exports can go well past what we keep
+            return
+
+        if len(self.records) >= SEG_ADDRS * self.hash_len:
+            self.flush()
+            self.start_segment(self.seg + 1, cache_hash_len())
+
+        digest = encode_addr(addr, self.salt)
+        self.records.extend(digest[0:self.hash_len])
+        for pos, mask in bloom_bits(digest, self.hash_len):
+            self.bloom[pos] |= mask
+
+        self.count += 1
 
     def fast_search(self, addr):
-        # Do the easy part of the searching, using the existing file's contents.
+        # Do the easy part of the searching, using the existing files' contents.
         # - generates candidate path subcomponents; might be false positive
-        # - working in-memory, since complete file isn't very large, and speed
-        from glob import dis
-
-        if not self.hdr or not self.count:
+        # - segments are read in order, and only as far as caller keeps asking
+        for _, subpath in self.fast_search_many([addr]):
+            yield subpath
+
+    def fast_search_many(self, addrs):
+        # Same, but for a list of addresses: each segment is read just once for all.
+        # - generates (addr, subpath) candidates
+        digests = [encode_addr(a, self.salt) for a in addrs]
+
+        base = 0
+        for seg, (hl, n) in enumerate(self.segs):
+            for which, idx in self.search_segment(seg, hl, n, digests):
+                yield addrs[which], (self.change_idx, base + idx)
+            base += n
+
+    def search_segment(self, seg, hash_len, count, digests):
+        # - bloom filter rules out most segments after reading just BLOOM_LEN bytes
+        # - records searched with bytes.find(), rather than record by record
+        # - yields (index into digests, record number)
+        if not count:
             return
 
-        with open(self.fname, 'rb') as fd:
+        with open(self.seg_fname(seg), 'rb') as fd:
             fd.seek(OWNERSHIP_FILE_HDR_LEN)
-            buf = fd.read(self.count * HASH_ENC_LEN)
 
-        assert len(buf) == (self.count * HASH_ENC_LEN)
+            if self.legacy:
+                maybe = range(len(digests))
+            else:
+                bloom = fd.read(BLOOM_LEN)
+                maybe = [i for i, d in enumerate(digests)
+                            if all(bloom[pos] & mask for pos, mask in bloom_bits(d, hash_len))]
+                del bloom
+
+                if not maybe:
+                    # definitely none of them in this segment
+                    return
+
+            buf = fd.read(count * hash_len)
 
-        chk = encode_addr(addr, self.salt)
-        for idx in range(self.count):
-            if buf[idx*HASH_ENC_LEN : (idx*HASH_ENC_LEN)+HASH_ENC_LEN] == chk:
-                yield (self.change_idx, idx)
+        assert len(buf) == (count * hash_len)
 
-            dis.progress_sofar(idx, self.count)
+        for which in maybe:
+            chk = digests[which][0:hash_len]
+            pos = buf.find(chk)
+            while pos >= 0:
+                if pos % hash_len:
+                    # straddles two records, not a match
+                    pos = buf.find(chk, pos + 1)
+                    continue
+
+                yield which, pos // hash_len
+                pos = buf.find(chk, pos + hash_len)
 
     def check_match(self, want_addr, subpath):
         # need to double-check matches, to get rid of false positives.
@@ -142,44 +291,44 @@ class AddressCacheFile:
         #print('(%d, %d) => %s ?= %s' % (chg, idx, got, want_addr))
         return want_addr == got
 
-    def build_and_search(self, addr):
-        # build many more addresses
-        # - return subpath for a hit or None
-        from glob import dis
-
+    def build_steps(self, wanted, chunk=BUILD_CHUNK):
+        # Build many more addresses, a chunk at a time, saving them as we go.
+        # - generator: yields None after each chunk, so caller can interleave others
+        # - wanted: set of addresses being looked for, shared w/ caller who removes
+        #   those found (by anyone); each hit here is yielded as (addr, subpath)
+        # - once nothing more is wanted after a hit here, does a bonus and stops
+        # - if abandoned part way, caller must do append(None) to save what we have
         bonus = 0
-        match = None
+        matched = False
 
-        start_idx = self.count
-        count = MAX_ADDRS_STORED - start_idx
+        # v1.0 file: start over in new format
+        start_idx = 0 if self.legacy else self.count
+        count = self.depth - start_idx
 
         if count <= 0:
-            return None
+            return
 
         self.setup(self.change_idx, start_idx)
 
         for idx,here,*_ in self.wallet.yield_addresses(start_idx, count,
                                                             change_idx=self.change_idx):
+            self.append(here)
 
-            if here == addr:
-                # Found it! But keep going a little for next time.
-                match = (self.change_idx, idx)
+            if here in wanted:
+                # Found one! But keep going a little for next time.
+                matched = True
+                yield here, (self.change_idx, idx)
 
-            self.append(here)
-            self.count += 1
-            if match:
+            if matched and not wanted:
                 bonus += 1
+                if bonus >= BONUS_GAP_LIMIT:
+                    break
 
-            if match and bonus >= BONUS_GAP_LIMIT:
-                self.append(None)
-                return match
-
-            dis.progress_sofar(idx-start_idx, count)
+            elif ((idx - start_idx + 1) % chunk) == 0:
+                yield None
 
         self.append(None)
 
-        return None
-
 class OwnershipCache:
 
     @classmethod
@@ -189,7 +338,7 @@ class OwnershipCache:
         # - not change -- only main addrs
         file = AddressCacheFile(wallet, change_idx)
 
-        if file.exists():
+        if file.exists() and not file.legacy:
             # don't save to existing file, has some already
             return None
 
@@ -206,17 +355,53 @@ class OwnershipCache:
         # Find it!
         # - returns wallet object, and tuple2 of final 2 subpath components
         # - if you start w/ testnet, we'll follow that
-        from multisig import MultisigWallet
-        from public_constants import AFC_SCRIPT, AF_P2WPKH_P2SH, AF_P2SH, AF_P2WSH_P2SH
-        from glob import dis
+        rv = cls.search_many([addr])[addr]
+        if isinstance(rv, str):
+            raise UnknownAddressExplained(rv)
 
+        return rv
+
+    @classmethod
+    def search_many(cls, addrs):
+        # Find many addresses in one pass.
+        # - returns dict: address => (wallet, subpath), or text explaining why not found
+        # - grouped by address format, and each group shares reading of the cache files
         ch = chains.current_chain()
 
-        addr_fmt = ch.possible_address_fmt(addr)
-        if not addr_fmt:
-            # might be valid address over on testnet vs mainnet
-            nm = ch.name if ch.ctype != 'BTC' else 'Bitcoin Mainnet'
-            raise UnknownAddressExplained('That address is not valid on ' + nm)
+        rv = {}
+        groups = {}
+        for addr in addrs:
+            addr_fmt = ch.possible_address_fmt(addr)
+            if not addr_fmt:
+                # might be valid address over on testnet vs mainnet
+                nm = ch.name if ch.ctype != 'BTC' else 'Bitcoin Mainnet'
+                rv[addr] = 'That address is not valid on ' + nm
+                continue
+
+            if addr_fmt not in groups:
+                groups[addr_fmt] = set()
+            groups[addr_fmt].add(addr)
+
+        for addr_fmt, wanted in groups.items():
+            try:
+                possibles = cls.possible_wallets(addr_fmt)
+            except UnknownAddressExplained as exc:
+                for addr in wanted:
+                    rv[addr] = str(exc)
+                continue
+
+            count = cls.search_wallets(possibles, wanted, rv)
+
+            for addr in wanted:
+                rv[addr] = 'Searched %d candidates without finding a match.' % count
+
+        return rv
+
+    @classmethod
+    def possible_wallets(cls, addr_fmt):
+        # All the wallets that could have made an address of this format
+        from multisig import MultisigWallet
+        from public_constants import AFC_SCRIPT, AF_P2WPKH_P2SH, AF_P2SH, AF_P2WSH_P2SH
 
         possibles = []
 
@@ -254,6 +439,14 @@ class OwnershipCache:
             raise UnknownAddressExplained(
                         "No suitable multisig wallets are currently defined.")
 
+        return possibles
+
+    @classmethod
+    def search_wallets(cls, possibles, wanted, rv):
+        # Look for the addresses in set wanted, which is updated: found ones are
+        # removed and put into rv dict. Returns number of candidates searched.
+        from glob import dis
+
         # "quick" check first, before doing any generations
 
         count = 0
@@ -266,14 +459,25 @@ class OwnershipCache:
                 else:
                     dis.fullscreen('Searching...')
 
-                for maybe in f.fast_search(addr):
+                for addr, maybe in f.fast_search_many(list(wanted)):
+                    if addr not in wanted:
+                        # already found, in this file
+                        continue
+
                     ok = f.check_match(addr, maybe)
                     if not ok: continue     # false positive - will happen
 
                     # found winner.
-                    return f.wallet, maybe
+                    rv[addr] = (f.wallet, maybe)
+                    wanted.remove(addr)
+                    if not wanted:
+                        # don't read any more segments
+                        break
 
-                if f.count < MAX_ADDRS_STORED:
+                if not wanted:
+                    return count
+
+                if f.count < f.depth or f.legacy:
                     phase2.append(f)
 
                 count += f.count
@@ -281,26 +485,107 @@ class OwnershipCache:
         # maybe we haven't calculated all the addresses yet, so do that
         # - very slow, but only needed once; any negative (failed) search causes this
         # - could stop when match found, but we go a bit beyond that for next time
-        # - we could search all in parallel, rather than serially because
-        #   more likely to find a match with low index... but seen as too much memory
-
-        for f in phase2:
-            b4 = f.count
+        # - all candidates take turns, a chunk each, since a match at low index in the
+        #   last wallet is more likely than a high index in the first one
+        # - as many at once as fit in memory budget (each holds a segment); rest wait
+        # - stops once all found, but saves what was generated by all of them
+        if phase2:
             if dis.has_lcd:
-                dis.fullscreen("Generating addresses...", line2=f.nice_name())
+                dis.fullscreen("Generating addresses...",
+                    line2=phase2[0].nice_name() if len(phase2) == 1
+                            else '%d wallet branches' % len(phase2))
             else:
                 dis.fullscreen("Generating...")
 
-            result = f.build_and_search(addr)
-            if result:
-                # found it, so report it and stop
-                return f.wallet, result
+        per_builder = (SEG_ADDRS * cache_hash_len()) + BLOOM_LEN + BUILDER_OVERHEAD
+        limit = max(1, PHASE2_MEM_BUDGET // per_builder)
 
-            count += f.count - b4
+        todo = sum(max(f.depth - (0 if f.legacy else f.count), 0) for f in phase2)
+        done = 0
+        active = []
+        try:
+            while phase2 or active:
+                while phase2 and len(active) < limit:
+                    f = phase2.pop(0)
+                    active.append((f, f.count, f.build_steps(wanted)))
+
+                for here in list(active):
+                    f, b4, steps = here
+                    was = f.count
+                    try:
+                        result = next(steps)
+                    except StopIteration:
+                        result = False
+                    done += f.count - was
+
+                    if result is None:
+                        # more to do, later
+                        continue
+
+                    if result:
+                        # found one
+                        addr, subpath = result
+                        rv[addr] = (f.wallet, subpath)
+                        wanted.remove(addr)
+
+                        if not wanted:
+                            # all found: let this one finish its bonus, and stop
+                            for _ in steps: pass
+                            count += f.count - b4
+                            active.remove(here)
+                            return count
+
+                        continue
+
+                    # this one is finished
+                    active.remove(here)
+                    count += f.count - b4
+
+                dis.progress_sofar(done, todo or 1)
+        finally:
+            for f, _, _ in active:
+                if hasattr(f, 'records'):
+                    # stopped part way: keep what was generated
+                    f.append(None)
 
         # possible phase 3: other seedvault... slow, rare and not implemented
 
-        raise UnknownAddressExplained('Searched %d candidates without finding a match.' % count)
+        return count
+
+    @classmethod
+    def search_batch(cls, lines):
+        # Verify a list of addresses: one per line, blank lines and #comments ignored.
+        # - generates CSV text for a results file, line by line, header first
+        # - returns (generator, number found, number of addresses)
+        addrs = []
+        for ln in lines:
+            ln = ln.strip()
+            if not ln or ln[0] == '#':
+                continue
+            addrs.append(ln)
+
+        if not addrs:
+            raise ValueError('No addresses')
+        if len(addrs) > MAX_BATCH_ADDRS:
+            raise ValueError('Too many addresses (max %d)' % MAX_BATCH_ADDRS)
+
+        found = cls.search_many(addrs)
+        hits = sum(1 for r in found.values() if not isinstance(r, str))
+
+        def quoted(*cols):
+            return ','.join('"%s"' % c.replace('"', '""') for c in cols) + '\n'
+
+        def gen():
+            yield quoted('Address', 'Wallet', 'Derivation', 'Error')
+            for addr in addrs:
+                r = found[addr]
+                if isinstance(r, str):
+                    yield quoted(addr, '', '', r)
+                else:
+                    wallet, subpath = r
+                    yield quoted(addr, wallet.name, wallet.render_path(*subpath), '')
+
+        return gen(), hits, len(found)
 
     @classmethod
     async def search_ux(cls, addr):
@@ -381,6 +666,52 @@ class OwnershipCache:
         ex.append(here)
         settings.set('accts', ex)
                 
+    @classmethod
+    def prewarm_candidates(cls):
+        # Every branch of every wallet we know of, in same order as search.
+        from multisig import MultisigWallet
+        from wallet import MasterSingleSigWallet
+        from public_constants import AF_CLASSIC, AF_P2WPKH, AF_P2WPKH_P2SH
+
+        wallets = []
+        accts = [(af, 0) for af in (AF_P2WPKH, AF_CLASSIC, AF_P2WPKH_P2SH)]
+        accts.extend(settings.get('accts', []))
+        for af, acct_num in accts:
+            try:
+                wallets.append(MasterSingleSigWallet(af, account_idx=acct_num))
+            except ValueError: pass
+
+        wallets.extend(MultisigWallet.get_all())
+
+        for change_idx in (0, 1):
+            for w in wallets:
+                yield AddressCacheFile(w, change_idx)
+
+    @classmethod
+    async def prewarm(cls):
+        # Extend caches until all are at full depth, or device no longer idle.
+        # - returns True if all done
+        from uasyncio import sleep_ms
+
+        for f in cls.prewarm_candidates():
+            if f.count >= f.depth and not f.legacy:
+                continue
+
+            start_idx = 0 if f.legacy else f.count
+            try:
+                for _ in f.build_steps(set(), chunk=PREWARM_CHUNK):
+                    await sleep_ms(0)
+                    if not prewarm_idle():
+                        return False
+            finally:
+                if hasattr(f, 'records'):
+                    # stopped part way: keep what we made, unless a search
+                    # (while we waited) got further already
+                    if AddressCacheFile(f.wallet, f.change_idx).count <= start_idx:
+                        f.append(None)
+
+        return True
+
     @classmethod
     def wipe_all(cls):
         # clear all cached addresses. will affect other seeds in vault
@@ -391,4 +722,39 @@ class OwnershipCache:
 # singleton, but also only created as needed; holds no state.
 OWNERSHIP = OwnershipCache()
 
+def prewarm_idle():
+    # Is the device idle at a menu, with nothing else going on?
+    import glob
+    from auth import UserAuthorizedAction
+    from ux import the_ux
+    from menu import MenuSystem
+
+    if glob.hsm_active or UserAuthorizedAction.active_request:
+        return False
+
+    if not isinstance(the_ux.top_of_stack(), MenuSystem):
+        return False
+
+    last = glob.numpad.last_event_time
+    return bool(last) and utime.ticks_diff(utime.ticks_ms(), last) > PREWARM_IDLE_MS
+
+async def prewarm_task():
+    # Background: build ownership caches while device sits idle, if enabled.
+    from uasyncio import sleep_ms
+    from pincodes import pa
+
+    while True:
+        await sleep_ms(PREWARM_POLL_MS)
+
+        if not settings.get('aobg', 0) or pa.is_secret_blank() or not prewarm_idle():
+            continue
+
+        try:
+            if await OWNERSHIP.prewarm():
+                # all done: check again much later, in case of new wallets or settings
+                await sleep_ms(PREWARM_POLL_MS * 60)
+        except Exception as exc:
+            # only a cache: never fatal
+            sys.print_exception(exc)
+
 # EOF
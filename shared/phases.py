@@ -0,0 +1,76 @@
+# (c) Copyright 2024 by Coinkite Inc. This file is covered by license found in COPYING-CC.
+#
+# phases.py - opt-in timing and heap measurements of PSBT signing, phase by phase
+#
+# - only active on simulator and dev builds; otherwise every call is a cheap no-op
+# - keeps a single report: the most recent transaction
+# - read back over USB (ptim) and in the HSM status report
+#
+import gc, utime, ckcc, version
+
+_cur = None         # run in progress
+_last = None        # report from most recent completed run
+
+def enabled():
+    return ckcc.is_simulator() or version.is_devmode
+
+class PhaseRun:
+    def __init__(self, label):
+        self.label = label
+        self.phases = []
+        self.t0 = self.t = utime.ticks_us()
+        self.heap = self.peak = self.phase_peak = gc.mem_alloc()
+        self.gcs = self.phase_gcs = 0
+
+    def sample(self):
+        # heap usage going down between samples means a collection ran,
+        # so the GC count is a lower bound, and peaks are only as good as
+        # the sampling rate
+        h = gc.mem_alloc()
+        if h < self.heap:
+            self.phase_gcs += 1
+        self.heap = h
+        if h > self.phase_peak:
+            self.phase_peak = h
+
+    def mark(self, name):
+        # close the phase that just finished
+        self.sample()
+        now = utime.ticks_us()
+        self.phases.append(dict(name=name, us=utime.ticks_diff(now, self.t),
+                                    peak=self.phase_peak, gcs=self.phase_gcs))
+        self.t = now
+        self.peak = max(self.peak, self.phase_peak)
+        self.gcs += self.phase_gcs
+        self.phase_peak = self.heap
+        self.phase_gcs = 0
+
+    def report(self, outcome):
+        return dict(label=self.label, outcome=outcome, phases=self.phases,
+                    total_us=utime.ticks_diff(self.t, self.t0),
+                    peak=self.peak, gcs=self.gcs, heap_free=gc.mem_free())
+
+def begin(label):
+    # start recording; any unfinished run is dropped
+    global _cur
+    _cur = PhaseRun(label) if enabled() else None
+
+def mark(name):
+    if _cur:
+        _cur.mark(name)
+
+def sample():
+    # call from inside long loops to catch heap peaks between marks
+    if _cur:
+        _cur.sample()
+
+def end(outcome='ok'):
+    global _cur, _last
+    if _cur:
+        _last = _cur.report(outcome)
+        _cur = None
+
+def last_report():
+    return _last
+
+# EOF
@@ -9,7 +9,8 @@ from utils import seconds2human_readable, datetime_from_timestamp, datetime_to_s
 import stash, gc, history, sys, ngu, ckcc, chains
 from uhashlib import sha256
 from uio import BytesIO
-from sffile import SizerFile
+from array import array
+from sffile import SizerFile, copy_buffer
 from multisig import MultisigWallet, disassemble_multisig, disassemble_multisig_mn
 from exceptions import FatalPSBTIssue, FraudulentChangeOutput
 from serializations import ser_compact_size, deser_compact_size, hash160, hash256
@@ -47,6 +48,9 @@ DEFAULT_MAX_FEE_PERCENTAGE = const(10)
 # print some things, sometimes
 DEBUG = ckcc.is_simulator()
 
+# size of a serialized CTxIn after its scriptSig is blanked: outpoint + empty script + nSequence
+BLANK_TXIN_LEN = const(32+4+1+4)
+
 class HashNDump:
     def __init__(self, d=None):
         self.rv = sha256()
@@ -66,9 +70,10 @@ def seq_to_str(seq):
     # take a set or list of numbers and show a tidy list in order.
     return ', '.join(str(i) for i in sorted(seq))
 
-def _skip_n_objs(fd, n, cls):
+def _skip_n_objs(fd, n, cls, offsets=None):
     # skip N sized objects in the stream, for example a vectors of CTxIns
     # - returns starting position
+    # - if offsets (an array) provided, the start position of each object is appended
 
     if cls == 'CTxIn':
         # output point(hash, n) + script sig + locktime
@@ -81,6 +86,8 @@ def _skip_n_objs(fd, n, cls):
 
     rv = fd.tell()
     for i in range(n):
+        if offsets is not None:
+            offsets.append(fd.tell())
         for p in pat:
             if p is None:
                 # variable-length part
@@ -133,22 +140,38 @@ def calc_txid(fd, poslen, body_poslen=None):
 
     return ngu.hash.sha256s(rv.digest())
 
+def _same_contents(fd, a, b):
+    # Are two (pos,len) regions of file byte-for-byte identical?
+    # - cheaper than hashing both of them
+    if a[1] != b[1]:
+        return False
+
+    off = 0
+    while off < a[1]:
+        here = min(1024, a[1] - off)
+        fd.seek(a[0] + off)
+        x = fd.read(here)
+        fd.seek(b[0] + off)
+        if x != fd.read(here):
+            return False
+        off += here
+
+    return True
+
 def get_hash256(fd, poslen, hasher=None):
     # return the double-sha256 of a value, without loading it into memory
     # - if hasher provided, just updates over region of file (not a sha256d)
     pos, ll = poslen
     rv = hasher or sha256()
 
-    tmp = bytearray(min(256, ll))
+    tmp = copy_buffer()
 
     fd.seek(pos)
     while ll:
-        here = fd.readinto(tmp)
+        here = fd.readinto(tmp[0:min(len(tmp), ll)])
         if not here:
             raise ValueError
-        if here > ll:
-            here = ll
-        rv.update(memoryview(tmp)[0:here])
+        rv.update(tmp[0:here])
         ll -= here
 
     if hasher:
@@ -232,10 +255,13 @@ class psbtProxy:
             (pos, ll) = val
             out_fd.write(ser_compact_size(ll))
             self.fd.seek(pos)
+            buf = copy_buffer()
             while ll:
-                t = self.fd.read(min(64, ll))
-                out_fd.write(t)
-                ll -= len(t)
+                here = self.fd.readinto(buf[0:min(len(buf), ll)])
+                if not here:
+                    raise ValueError
+                out_fd.write(buf[0:here])
+                ll -= here
 
         elif isinstance(val, list):
             # for subpaths lists (LE32 ints)
@@ -546,9 +572,11 @@ class psbtInputProxy(psbtProxy):
 
     blank_flds = (
         'unknown', 'utxo', 'witness_utxo', 'sighash', 'redeem_script', 'witness_script',
+        'part_sig', 'subpaths',
         'fully_signed', 'is_segwit', 'is_multisig', 'is_p2sh', 'num_our_keys',
         'required_key', 'scriptSig', 'amount', 'scriptCode', 'added_sig', 'previous_txid',
-        'prevout_idx', 'sequence', 'req_time_locktime', 'req_height_locktime'
+        'prevout_idx', 'sequence', 'req_time_locktime', 'req_height_locktime',
+        'utxo_outs'
     )
 
     def __init__(self, fd, idx):
@@ -556,9 +584,9 @@ class psbtInputProxy(psbtProxy):
 
         #self.utxo = None
         #self.witness_utxo = None
-        self.part_sig = {}
+        #self.part_sig = None       # a dictionary if non-empty
         #self.sighash = None
-        self.subpaths = {}          # will typically be non-empty for all inputs
+        #self.subpaths = None       # a dictionary; will typically be non-empty for all inputs
         #self.redeem_script = None
         #self.witness_script = None
 
@@ -587,6 +615,9 @@ class psbtInputProxy(psbtProxy):
         #self.req_time_locktime = None
         #self.req_height_locktime = None
 
+        # offsets of each output in self.utxo, shared w/ other inputs spending same txn
+        #self.utxo_outs = None
+
         self.parse(fd)
 
     def has_relative_timelock(self, txin):
@@ -635,7 +666,7 @@ class psbtInputProxy(psbtProxy):
             # - seems harmless if they fool us into thinking already signed; we do nothing
             # - could also look at pubkey needed vs. sig provided
             # - could consider structure of MofN in p2sh cases
-            self.fully_signed = (len(self.part_sig) >= len(self.subpaths))
+            self.fully_signed = (len(self.part_sig) >= len(self.subpaths or ()))
         else:
             # No signatures at all yet for this input (typical non multisig)
             self.fully_signed = False
@@ -646,12 +677,22 @@ class psbtInputProxy(psbtProxy):
             # (but if it's segwit, the ploy wouldn't work, Segwit FtW)
             # - challenge: it's a straight dsha256() for old serializations, but not for newer
             #   segwit txn's... plus I don't want to deserialize it here.
-            try:
-                observed = uint256_from_str(calc_txid(self.fd, self.utxo))
-            except:
-                raise AssertionError("Trouble parsing UTXO given for input #%d" % idx)
+            # - when same txn already given (and verified) for another input, just
+            #   compare contents, and share a table of its output positions
+            memo = parent.utxo_memo.get(txin.prevout.hash)
+            if memo and _same_contents(self.fd, memo[0], self.utxo):
+                if memo[1] is None:
+                    memo[1] = array('I')
+                self.utxo_outs = memo[1]
+            else:
+                try:
+                    observed = uint256_from_str(calc_txid(self.fd, self.utxo))
+                except:
+                    raise AssertionError("Trouble parsing UTXO given for input #%d" % idx)
 
-            assert txin.prevout.hash == observed, "utxo hash mismatch for input #%d" % idx
+                assert txin.prevout.hash == observed, "utxo hash mismatch for input #%d" % idx
+
+                parent.utxo_memo[observed] = [self.utxo, None]
 
     def handle_none_sighash(self):
         if self.sighash is None:
@@ -685,6 +726,18 @@ class psbtInputProxy(psbtProxy):
 
         assert self.utxo, 'no utxo'
 
+        outs = self.utxo_outs
+        if outs:
+            # another input already found where each output is
+            assert idx < len(outs), "not enuf outs"
+            fd.seek(self.utxo[0] + outs[idx])
+
+            utxo = CTxOut()
+            utxo.deserialize(fd)
+            fd.seek(old_pos)
+
+            return utxo
+
         # skip over all the parts of the txn we don't care about, without
         # fully parsing it... pull out a single TXO
         fd.seek(self.utxo[0])
@@ -702,7 +755,15 @@ class psbtInputProxy(psbtProxy):
 
         num_out = deser_compact_size(fd)
         assert idx < num_out, "not enuf outs"
-        _skip_n_objs(fd, idx, 'CTxOut')
+
+        if outs is not None:
+            # txn shared w/ other inputs: record where each output is, for them
+            _skip_n_objs(fd, num_out, 'CTxOut', outs)
+            for i in range(num_out):
+                outs[i] -= self.utxo[0]
+            fd.seek(self.utxo[0] + outs[idx])
+        else:
+            _skip_n_objs(fd, idx, 'CTxOut')
 
         utxo = CTxOut()
         utxo.deserialize(fd)
@@ -881,8 +942,12 @@ class psbtInputProxy(psbtProxy):
         elif kt == PSBT_IN_WITNESS_UTXO:
             self.witness_utxo = val
         elif kt == PSBT_IN_PARTIAL_SIG:
+            if not self.part_sig:
+                self.part_sig = {}
             self.part_sig[key[1:]] = val
         elif kt == PSBT_IN_BIP32_DERIVATION:
+            if not self.subpaths:
+                self.subpaths = {}
             self.subpaths[key[1:]] = val
         elif kt == PSBT_IN_REDEEM_SCRIPT:
             self.redeem_script = val
@@ -928,8 +993,9 @@ class psbtInputProxy(psbtProxy):
         if self.sighash is not None:
             wr(PSBT_IN_SIGHASH_TYPE, pack('<I', self.sighash))
 
-        for k in self.subpaths:
-            wr(PSBT_IN_BIP32_DERIVATION, self.subpaths[k], k)
+        if self.subpaths:
+            for k in self.subpaths:
+                wr(PSBT_IN_BIP32_DERIVATION, self.subpaths[k], k)
 
         if self.redeem_script:
             wr(PSBT_IN_REDEEM_SCRIPT, self.redeem_script)
@@ -982,23 +1048,28 @@ class psbtObject(psbtProxy):
         self.fallback_locktime = None
         self.vin_start = None
         self.vout_start = None
+        self.vin_offsets = None         # array: position of each txin in unsigned txn
+        self.vout_offsets = None        # array: position of each txout
         self.wit_start = None
         self.txn_version = None
         self._lock_time = None
         self.total_value_out = None
         self.total_value_in = None
         self.presigned_inputs = set()
+        # non-witness UTXO already verified: txid => [(pos, len), output offsets or None]
+        self.utxo_memo = {}
         # will be tru if number of change outputs equals to total number of outputs
         self.consolidation_tx = False
         # number of change outputs
         self.num_change_outputs = None
         self.total_change_value = None
 
-        # when signing segwit stuff, there is some re-use of hashes
-        # only if SIGHASH_ALL
-        self.hashPrevouts = None
-        self.hashSequence = None
-        self.hashOutputs = None
+        # parts of txn (serialized or hashed) which are shared by all inputs
+        # when calculating sighash values
+        # - legacy: ('ins', zero_seq) and 'outs'
+        # - segwit (BIP-143): 'hashPrevouts', 'hashSequence', 'hashOutputs'
+        #   and ('hashOutputs', idx) for SIGHASH_SINGLE
+        self.sighash_cache = {}
 
         # this points to a MS wallet, during operation
         # - we are only supporting a single multisig wallet during signing
@@ -1066,13 +1137,11 @@ class psbtObject(psbtProxy):
                 total_out += amount
                 yield idx, tx_out
         else:
-            assert self.vout_start is not None     # must call input_iter/validate first
+            assert self.vout_offsets is not None     # must call parse_txn first
 
             fd = self.fd
-            fd.seek(self.vout_start)
-
-            if start != 0:
-                _skip_n_objs(fd, start, 'CTxOut')
+            if start < stop:
+                fd.seek(self.vout_offsets[start])
 
             tx_out = CTxOut()
             for idx in range(start, stop):
@@ -1114,12 +1183,15 @@ class psbtObject(psbtProxy):
         self.num_inputs = num_in
 
         # all the ins are in sequence starting at this position
-        self.vin_start = _skip_n_objs(fd, num_in, 'CTxIn')
+        # - record where each one starts, so we can seek directly to any of them later
+        self.vin_offsets = array('I')
+        self.vin_start = _skip_n_objs(fd, num_in, 'CTxIn', self.vin_offsets)
 
         # next is outputs
         self.num_outputs = deser_compact_size(fd)
 
-        self.vout_start = _skip_n_objs(fd, self.num_outputs, 'CTxOut')
+        self.vout_offsets = array('I')
+        self.vout_start = _skip_n_objs(fd, self.num_outputs, 'CTxOut', self.vout_offsets)
 
         end_pos = sum(self.txn)
 
@@ -1137,15 +1209,19 @@ class psbtObject(psbtProxy):
 
         fd.seek(old_pos)
 
-    def input_iter(self):
+    def input_iter(self, start=0, stop=None):
         # Yield each of the txn's inputs, as a tuple:
         #
         #   (index, CTxIn)
         #
         # - we also capture much data about the txn on the first pass thru here
+        # - can start at any index, without reading those before it
         #
+        if stop is None:
+            stop = self.num_inputs
+
         if self.is_v2:
-            for idx in range(self.num_inputs):
+            for idx in range(start, stop):
                 inp = self.inputs[idx]
                 prevout = COutPoint(uint256_from_str(self.get(inp.previous_txid)),
                                     unpack("<I", self.get(inp.prevout_idx))[0])
@@ -1155,12 +1231,13 @@ class psbtObject(psbtProxy):
         else:
             fd = self.fd
 
-            assert self.vin_start
+            assert self.vin_offsets
             # stream out the inputs
-            fd.seek(self.vin_start)
+            if start < stop:
+                fd.seek(self.vin_offsets[start])
 
             txin = CTxIn()
-            for idx in range(self.num_inputs):
+            for idx in range(start, stop):
                 txin.deserialize(fd)
 
                 cont = fd.tell()
@@ -1762,7 +1839,23 @@ class psbtObject(psbtProxy):
         assert rv.num_inputs is not None
         assert rv.num_outputs is not None
         rv.inputs = [psbtInputProxy(fd, idx) for idx in range(rv.num_inputs)]
-        rv.outputs = [psbtOutputProxy(fd, idx) for idx in range(rv.num_outputs)]
+
+        # Outputs without any PSBT fields (common in large batch payouts) are
+        # never modified, so they can all share a single proxy object.
+        rv.outputs = []
+        empty = None
+        for idx in range(rv.num_outputs):
+            pos = fd.tell()
+            if empty is not None and fd.read(1) == b'\0':
+                rv.outputs.append(empty)
+                continue
+
+            fd.seek(pos)
+            here = psbtOutputProxy(fd, idx)
+            if empty is None and fd.tell() == pos+1:
+                empty = here
+
+            rv.outputs.append(here)
 
         return rv
 
@@ -1829,8 +1922,11 @@ class psbtObject(psbtProxy):
         # - update our state with new partial sigs
         from glob import dis
         from ownership import OWNERSHIP
+        import phases
 
         with stash.SensitiveValues() as sv:
+            phases.mark('unlock')
+
             # Double check the change outputs are right. This is slow, but critical because
             # it detects bad actors, not bugs or mistakes.
             # - equivilent check already done for p2sh outputs when we re-built the redeem script
@@ -1866,72 +1962,58 @@ class psbtObject(psbtProxy):
                               "Deception regarding change output. "
                               "BIP-32 path doesn't match actual address.")
 
+            # Plan our work: which inputs we will sign, and with which key(s).
+            # - sorted by derivation path, so inputs sharing a parent node are
+            #   signed together, and each parent is derived just once
+            plan = self.signing_plan()
+            phases.mark('change_check')
+
             # progress
             dis.fullscreen('Signing...')
             # randomize secp context before each signing session
             ngu.secp256k1.ctx_rnd()
             # Sign individual inputs
-            success = set()
-            for in_idx, txi in self.input_iter():
-                dis.progress_sofar(in_idx, self.num_inputs)
+            parent_path = parent = None
+            for count, (path, in_idx, which_key) in enumerate(plan):
+                dis.progress_sofar(count, len(plan))
+                phases.sample()
 
                 inp = self.inputs[in_idx]
 
-                if not inp.has_utxo():
-                    # maybe they didn't provide the UTXO
+                if inp.added_sig:
+                    # multisig: already signed using another of the candidate keys
                     continue
 
-                if not inp.required_key:
-                    # we don't know the key for this input
-                    continue
+                if path[:-1] != parent_path:
+                    # shared w/ derivation cache, do not modify
+                    parent_path = path[:-1]
+                    parent = sv.derived_node(parent_path)
+
+                # get node required
+                node = parent.copy()
+                node.derive(path[-1] & 0x7fffffff, bool(path[-1] & 0x80000000))
+
+                # expensive test, but works... and important
+                pu = node.pubkey()
+                if pu != which_key:
+                    stash.blank_object(node)
+                    if inp.is_multisig:
+                        # need to consider a set of possible keys, since xfp may not be unique
+                        continue
 
-                if inp.fully_signed:
-                    # for multisig, it's possible I need to add another sig
-                    # but in other cases, no more signatures are possible
-                    continue
+                    raise AssertionError("Path (%s) led to wrong pubkey for input#%d"
+                                            % (keypath_to_str(path, skip=0), in_idx))
+
+                if not inp.is_multisig:
+                    # track wallet usage
+                    OWNERSHIP.note_subpath_used(inp.subpaths[which_key])
+
+                _, txi = next(self.input_iter(in_idx, in_idx+1))
 
                 txi.scriptSig = inp.scriptSig
                 assert txi.scriptSig, "no scriptsig?"
 
                 inp.handle_none_sighash()
-                if inp.is_multisig:
-                    # need to consider a set of possible keys, since xfp may not be unique
-                    for which_key in inp.required_key:
-                        # get node required
-                        skp = keypath_to_str(inp.subpaths[which_key])
-                        node = sv.derive_path(skp, register=False)
-
-                        # expensive test, but works... and important
-                        pu = node.pubkey()
-                        if pu == which_key:
-                            break
-                    else:
-                        raise AssertionError("Input #%d needs pubkey I dont have" % in_idx)
-
-                else:
-                    # single pubkey <=> single key
-                    which_key = inp.required_key
-
-    
-                    assert not inp.added_sig, "already done??"
-                    assert which_key in inp.subpaths, 'unk key'
-
-                    if inp.subpaths[which_key][0] != self.my_xfp:
-                        # we don't have the key for this subkey
-                        # (redundant, required_key wouldn't be set)
-                        continue
-
-                    # get node required
-                    skp = keypath_to_str(inp.subpaths[which_key])
-                    node = sv.derive_path(skp, register=False)
-
-                    # expensive test, but works... and important
-                    pu = node.pubkey()
-                    assert pu == which_key, \
-                        "Path (%s) led to wrong pubkey for input#%d"%(skp, in_idx)
-
-                    # track wallet usage
-                    OWNERSHIP.note_subpath_used(inp.subpaths[which_key])
 
                 if sv.deltamode:
                     # Current user is actually a thug with a slightly wrong PIN, so we
@@ -1984,7 +2066,7 @@ class psbtObject(psbtProxy):
                 # private key no longer required
                 stash.blank_object(pk)
                 stash.blank_object(node)
-                del pk, node, pu, skp, n
+                del pk, node, pu, n
 
                 inp.added_sig = (which_key, der_sig)
 
@@ -1993,19 +2075,68 @@ class psbtObject(psbtProxy):
                 # signature (taproot SIGHASH_DEFAULT)
                 ## inp.sighash = None
 
-                success.add(in_idx)
-
                 if self.is_v2:
                     self.set_modifiable_flag(inp)
 
                 # memory cleanup
-                del result, r, s
+                del result, r, s, txi
 
                 gc.collect()
 
+            for _, in_idx, _ in plan:
+                # multisig inputs where none of the candidate keys worked
+                if not self.inputs[in_idx].added_sig:
+                    raise AssertionError("Input #%d needs pubkey I dont have" % in_idx)
+
+            phases.mark('sign')
+
         # done.
         dis.progress_bar_show(1)
 
+    def signing_plan(self):
+        # Decide which inputs we will sign, and the candidate key(s) for each.
+        # - returns list of (path, input index, pubkey), sorted by path
+        # - path is tuple of ints, without the XFP
+        # - multisig inputs may have more than one candidate (dup XFP values)
+        plan = []
+
+        for in_idx, inp in enumerate(self.inputs):
+            if not inp.has_utxo():
+                # maybe they didn't provide the UTXO
+                continue
+
+            if not inp.required_key:
+                # we don't know the key for this input
+                continue
+
+            if inp.fully_signed:
+                # for multisig, it's possible I need to add another sig
+                # but in other cases, no more signatures are possible
+                continue
+
+            if inp.is_multisig:
+                keys = inp.required_key
+            else:
+                # single pubkey <=> single key
+                which_key = inp.required_key
+
+                assert not inp.added_sig, "already done??"
+                assert which_key in inp.subpaths, 'unk key'
+
+                if inp.subpaths[which_key][0] != self.my_xfp:
+                    # we don't have the key for this subkey
+                    # (redundant, required_key wouldn't be set)
+                    continue
+
+                keys = [which_key]
+
+            for pubkey in keys:
+                plan.append((tuple(inp.subpaths[pubkey][1:]), in_idx, pubkey))
+
+        plan.sort()
+
+        return plan
+
     def set_modifiable_flag(self, inp):
         # only for PSBTv2
         # sighash needs to be properly set on psbtInputProxy object before this runs
@@ -2032,15 +2163,51 @@ class psbtObject(psbtProxy):
             # Bit 2 is the Has SIGHASH_SINGLE flag - set it to 1
             self.txn_modifiable |= 4
 
+    def legacy_sighash_inputs(self, zero_seq):
+        # Serialized inputs, with all scriptSigs blanked, as used by legacy sighash.
+        # - built once and shared by all inputs being signed
+        # - blanked inputs are fixed size: outpoint(36) + empty script(1) + nSequence(4)
+        # - if zero_seq, nSequence of each is zeroed (SIGHASH_NONE/SINGLE cases)
+        key = ('ins', zero_seq)
+        rv = self.sighash_cache.get(key)
+        if rv is None:
+            rv = bytearray()
+            for in_idx, txi in self.input_iter():
+                if zero_seq:
+                    txi.nSequence = 0
+                txi.scriptSig = b''
+                rv.extend(txi.serialize())
+
+            assert len(rv) == BLANK_TXIN_LEN * self.num_inputs
+            self.sighash_cache[key] = rv
+
+        return rv
+
+    def legacy_sighash_outputs(self):
+        # Serialized outputs (with count) for SIGHASH_ALL case; built once.
+        rv = self.sighash_cache.get('outs')
+        if rv is None:
+            rv = bytearray(ser_compact_size(self.num_outputs))
+            for out_idx, txo in self.output_iter():
+                rv.extend(txo.serialize())
+
+            self.sighash_cache['outs'] = rv
+
+        return rv
+
     def make_txn_sighash(self, replace_idx, replacement, sighash_type):
         # calculate the hash value for one input of current transaction
         # - blank all script inputs
         # - except one single tx in, which is provided
         # - serialize that without witness data
         # - sha256 over that
+        # - blanked inputs and outputs are serialized once, and re-used for each input
         fd = self.fd
         old_pos = fd.tell()
 
+        assert not self.inputs[replace_idx].is_segwit
+        assert replacement.scriptSig
+
         # sighash regardless of ANYONECANPAY input part
         out_sighash_type = sighash_type & 0x7f
 
@@ -2050,22 +2217,21 @@ class psbtObject(psbtProxy):
         rv.update(pack('<i', self.txn_version))           # nVersion
 
         # inputs
-        num_inputs = 1 if sighash_type & SIGHASH_ANYONECANPAY else self.num_inputs
-        rv.update(ser_compact_size(num_inputs))
-        for in_idx, txi in self.input_iter():
-            if in_idx == replace_idx:
-                assert not self.inputs[in_idx].is_segwit
-                assert replacement.scriptSig
-                rv.update(replacement.serialize())
-            elif not (sighash_type & SIGHASH_ANYONECANPAY):
-                if out_sighash_type in (SIGHASH_NONE, SIGHASH_SINGLE):
-                    # do not include sequence of other inputs (zero them for digest)
-                    # which means that they can be replaced
-                    txi.nSequence = 0
-                txi.scriptSig = b''
-                rv.update(txi.serialize())
-            # else:
-            #    is SIGHASH_ANYONECANPAY so we do not include any other inputs
+        if sighash_type & SIGHASH_ANYONECANPAY:
+            # do not include any other inputs
+            rv.update(ser_compact_size(1))
+            rv.update(replacement.serialize())
+        else:
+            # for NONE and SINGLE, do not include sequence of other inputs (zero
+            # them for digest) which means that they can be replaced
+            blanked = memoryview(self.legacy_sighash_inputs(
+                            out_sighash_type in (SIGHASH_NONE, SIGHASH_SINGLE)))
+            here = replace_idx * BLANK_TXIN_LEN
+
+            rv.update(ser_compact_size(self.num_inputs))
+            rv.update(blanked[0:here])
+            rv.update(replacement.serialize())
+            rv.update(blanked[here+BLANK_TXIN_LEN:])
 
         # outputs
         if out_sighash_type == SIGHASH_NONE:
@@ -2073,16 +2239,14 @@ class psbtObject(psbtProxy):
         elif out_sighash_type == SIGHASH_SINGLE:
             rv.update(ser_compact_size(replace_idx+1))
             assert replace_idx < self.num_outputs, "SINGLE corresponding output (%d) missing" % replace_idx
-            for out_idx, txo in self.output_iter():
-                if out_idx < replace_idx:
-                    rv.update(CTxOut(-1).serialize())
-                if out_idx == replace_idx:
-                    rv.update(txo.serialize())
+            blank = CTxOut(-1).serialize()
+            for _ in range(replace_idx):
+                rv.update(blank)
+            _, txo = next(self.output_iter(replace_idx, replace_idx+1))
+            rv.update(txo.serialize())
         else:
             assert out_sighash_type == SIGHASH_ALL
-            rv.update(ser_compact_size(self.num_outputs))
-            for out_idx, txo in self.output_iter():
-                rv.update(txo.serialize())
+            rv.update(self.legacy_sighash_outputs())
 
         # locktime, sighash_type
         rv.update(pack('<II', self.lock_time, sighash_type))
@@ -2092,6 +2256,51 @@ class psbtObject(psbtProxy):
         # double SHA256
         return ngu.hash.sha256s(rv.digest())
 
+    def segwit_hash_prevouts(self):
+        # BIP-143 hashPrevouts: same for all inputs w/o ANYONECANPAY; calculated once
+        rv = self.sighash_cache.get('hashPrevouts')
+        if rv is None:
+            h = sha256()
+            for in_idx, txi in self.input_iter():
+                h.update(txi.prevout.serialize())
+
+            rv = self.sighash_cache['hashPrevouts'] = ngu.hash.sha256s(h.digest())
+
+        return rv
+
+    def segwit_hash_sequence(self):
+        # BIP-143 hashSequence: only used for ALL w/o ANYONECANPAY; calculated once
+        rv = self.sighash_cache.get('hashSequence')
+        if rv is None:
+            h = sha256()
+            for in_idx, txi in self.input_iter():
+                h.update(pack("<I", txi.nSequence))
+
+            rv = self.sighash_cache['hashSequence'] = ngu.hash.sha256s(h.digest())
+
+        return rv
+
+    def segwit_hash_outputs(self, single_idx=None):
+        # BIP-143 hashOutputs: over all outputs (SIGHASH_ALL) or just the one
+        # output matching input index (SIGHASH_SINGLE); each calculated once
+        key = 'hashOutputs' if single_idx is None else ('hashOutputs', single_idx)
+        rv = self.sighash_cache.get(key)
+        if rv is None:
+            if single_idx is None:
+                h = sha256()
+                for out_idx, txo in self.output_iter():
+                    h.update(txo.serialize())
+
+                rv = ngu.hash.sha256s(h.digest())
+            else:
+                _, txo = next(self.output_iter(single_idx, single_idx+1))
+                rv = ngu.hash.sha256d(txo.serialize())
+
+            self.sighash_cache[key] = rv
+            gc.collect()
+
+        return rv
+
     def make_txn_segwit_sighash(self, replace_idx, replacement, amount, scriptCode, sighash_type):
         # Implement BIP 143 hashing algo for signature of segwit programs.
         # see <https://github.com/bitcoin/bips/blob/master/bip-0143.mediawiki>
@@ -2102,60 +2311,38 @@ class psbtObject(psbtProxy):
         # sighash regardless of ANYONECANPAY input part
         out_sighash_type = sighash_type & 0x7f
 
-        if self.hashPrevouts and sighash_type == SIGHASH_ALL:
-            hashPrevouts = self.hashPrevouts
-            hashSequence = self.hashSequence
-            hashOutputs = self.hashOutputs
+        # input side
+        if sighash_type & SIGHASH_ANYONECANPAY:
+            hashPrevouts = hashSequence = None
         else:
-            # input side
-            hashPrevouts = sha256()
-            hashSequence = sha256()
-
-            if not (sighash_type & SIGHASH_ANYONECANPAY):
-                for in_idx, txi in self.input_iter():
-                    hashPrevouts.update(txi.prevout.serialize())
-                    if out_sighash_type == SIGHASH_ALL:
-                        hashSequence.update(pack("<I", txi.nSequence))
-
-                hashPrevouts = ngu.hash.sha256s(hashPrevouts.digest())
-                if out_sighash_type == SIGHASH_ALL:
-                    hashSequence = ngu.hash.sha256s(hashSequence.digest())
-
-            # output side
-            hashOutputs = sha256()
+            hashPrevouts = self.segwit_hash_prevouts()
             if out_sighash_type == SIGHASH_ALL:
-                for out_idx, txo in self.output_iter():
-                    hashOutputs.update(txo.serialize())
-
-                hashOutputs = ngu.hash.sha256s(hashOutputs.digest())
-
-            elif out_sighash_type == SIGHASH_SINGLE:
-                # Even though below case is consensus valid, we block it.
-                # If users do not want to sign any outputs, NONE sighash flag
-                # should be used instead.
-                assert replace_idx < self.num_outputs, \
-                            "SINGLE corresponding output (%d) missing" % replace_idx
-
-                for out_idx, txo in self.output_iter():
-                    if out_idx == replace_idx:
-                        hashOutputs = ngu.hash.sha256d(txo.serialize())
+                hashSequence = self.segwit_hash_sequence()
             else:
-                assert out_sighash_type == SIGHASH_NONE
+                hashSequence = None
 
-            if sighash_type == SIGHASH_ALL:
-                # cache this multitude of hashes
-                self.hashPrevouts = hashPrevouts
-                self.hashSequence = hashSequence
-                self.hashOutputs = hashOutputs
+        # output side
+        if out_sighash_type == SIGHASH_ALL:
+            hashOutputs = self.segwit_hash_outputs()
 
-            gc.collect()
+        elif out_sighash_type == SIGHASH_SINGLE:
+            # Even though below case is consensus valid, we block it.
+            # If users do not want to sign any outputs, NONE sighash flag
+            # should be used instead.
+            assert replace_idx < self.num_outputs, \
+                        "SINGLE corresponding output (%d) missing" % replace_idx
+
+            hashOutputs = self.segwit_hash_outputs(replace_idx)
+        else:
+            assert out_sighash_type == SIGHASH_NONE
+            hashOutputs = None
 
         rv = sha256()
 
         # version number
         rv.update(pack('<i', self.txn_version))       # nVersion
-        rv.update(hashPrevouts if isinstance(hashPrevouts, bytes) else bytes(32))
-        rv.update(hashSequence if isinstance(hashSequence, bytes) else bytes(32))
+        rv.update(hashPrevouts or bytes(32))
+        rv.update(hashSequence or bytes(32))
 
         rv.update(replacement.prevout.serialize())
 
@@ -2166,7 +2353,7 @@ class psbtObject(psbtProxy):
         rv.update(pack("<q", amount))
         rv.update(pack("<I", replacement.nSequence))
 
-        rv.update(hashOutputs if isinstance(hashOutputs, bytes) else bytes(32))
+        rv.update(hashOutputs or bytes(32))
 
         # locktime, sighash_type
         rv.update(pack('<II', self.lock_time, sighash_type))
@@ -32,7 +32,8 @@ class PSRAMWrapper:
     # Be compatible with SPIFlash class...
 
     def read(self, address, buf, cmd=None):
-        buf[:] = self.read_at(address, len(buf))
+        # copy straight into buf (which may be a memoryview); no temp object
+        buf[:] = memoryview(self._wr)[address:address+len(buf)]
 
     def write(self, address, buf):
         ln = len(buf)
@@ -16,6 +16,19 @@ blksize = 4
 def ALIGN4(n):
      return n & ~0x3
 
+# Shared buffer for bulk copies and hashing of large regions out of PSRAM
+# - allocated once, on first use, to avoid a new object per chunk
+# - not re-entrant: fill it and consume it, do not hold it across other calls
+COPY_BUF_SIZE = const(4096)
+_copy_buf = None
+
+def copy_buffer():
+    # return shared buffer, as a memoryview so slicing it is zero-copy
+    global _copy_buf
+    if _copy_buf is None:
+        _copy_buf = memoryview(bytearray(COPY_BUF_SIZE))
+    return _copy_buf
+
 class SFFile:
     def __init__(self, start, length=0, max_size=None, message=None):
         # Operate in PSRAM and pretend to be a filesystem's file
@@ -151,11 +164,20 @@ class SFFile:
         return bytes(rv)
 
     def readinto(self, b):
-        # limitation: this will read past end of file, but not tell the caller
+        # read up to len(b) bytes; b may be a memoryview (zero-copy slices)
         actual = min(self.length - self.pos, len(b))
         if actual <= 0:
             return 0
 
+        if actual < len(b):
+            b = memoryview(b)[0:actual]
+
+        if self.runt and self.pos + actual > self.wr_pos:
+            # put the runt data into place, because we are about to read it
+            t = bytearray(self.runt)
+            t.extend(bytes(4-len(t)))
+            PSRAM.write(self.start + self.wr_pos, t)
+
         PSRAM.read(self.start + self.pos, b)
 
         self.pos += actual
@@ -180,6 +180,11 @@ class SensitiveValues:
     def __init__(self, secret=None, bip39pw='', bypass_tmp=False):
         self.spots = []
 
+        # intermediate nodes derived from master: path prefix (tuple of ints) => node
+        # - lets related paths (same account, same branch) skip the hardened steps
+        # - nodes are registered in spots, so wiped on exit
+        self.derived = {}
+
         self._bip39pw = bip39pw
 
         if secret is not None:
@@ -293,6 +298,7 @@ class SensitiveValues:
 
         # just in case this holds some pointers?
         del self.spots
+        del self.derived
 
         # .. and some GC will help too!
         gc.collect()
@@ -332,13 +338,27 @@ class SensitiveValues:
         # supports bip32 nodes
         self.spots.append(item)
 
-    def derive_path(self, path, master=None, register=True):
-        # Given a string path, derive the related subkey
-        rv = (master or self.node).copy()
+    def derived_node(self, prefix):
+        # Return (shared, do not modify) node for path prefix, derived from master
+        # - prefix is tuple of ints, with hardened bit
+        # - each level is derived only once per session
+        if not prefix:
+            return self.node
+
+        rv = self.derived.get(prefix)
+        if rv is None:
+            rv = self.derived_node(prefix[:-1]).copy()
+            here = prefix[-1]
+            rv.derive(here & 0x7fffffff, bool(here & 0x80000000))
 
-        if register:
             self.register(rv)
+            self.derived[prefix] = rv
+
+        return rv
 
+    def derive_path(self, path, master=None, register=True):
+        # Given a string path, derive the related subkey
+        steps = []
         for i in path.split('/'):
             if i == 'm': continue
             if not i: continue      # trailing or duplicated slashes
@@ -352,7 +372,20 @@ class SensitiveValues:
                 is_hard = False
 
             assert 0 <= here < 0x80000000
-            rv.derive(here, is_hard)
+            steps.append((here | 0x80000000) if is_hard else here)
+
+        if master is None and steps:
+            # from our master: start from (cached) parent, one last step to do
+            rv = self.derived_node(tuple(steps[:-1])).copy()
+            steps = steps[-1:]
+        else:
+            rv = (master or self.node).copy()
+
+        if register:
+            self.register(rv)
+
+        for here in steps:
+            rv.derive(here & 0x7fffffff, bool(here & 0x80000000))
 
         return rv
 
@@ -48,9 +48,10 @@ hid_descp = bytes([
 HSM_WHITELIST = frozenset({
     'logo', 'ping', 'vers',     # harmless/boring
     'upld', 'sha2', 'dwld', 'stxn',     # up/download/sign PSBT needed
+    'qtxn', 'qtok',             # queue PSBT for signing, and get its result
     'mitm', 'ncry',             # maybe limited by policy tho
     'smsg',                     # limited by policy
-    'blkc', 'hsts',             # report status values
+    'blkc', 'hsts', 'ptim',     # report status values
     'stok', 'smok',             # completion check: sign txn or msg
     'xpub', 'msck',             # quick status checks
     'p2sh', 'show',             # limited by HSM policy
@@ -491,6 +492,18 @@ class USBHandler:
 
             return None
 
+        if cmd == 'vadr':
+            # Verify a list of addresses, one per line; results are a CSV file
+            # - text file must already be uploaded, collect results w/ 'vaok'
+            file_len, file_sha = unpack_from('<I32s', args)
+            if file_sha != self.file_checksum.digest():
+                return b'err_Checksum'
+            assert 2 <= file_len <= MAX_TXN_LEN, "badlen"
+
+            from auth import start_verify_addresses
+            start_verify_addresses(file_len)
+            return None
+
         if cmd == 'msck':
             # Quick check to test if we have a wallet already installed.
             from multisig import MultisigWallet
@@ -510,7 +523,40 @@ class USBHandler:
             sign_transaction(txn_len, (flags & STXN_FLAGS_MASK), txn_sha)
             return None
 
-        if cmd == 'stok' or cmd == 'bkok' or cmd == 'smok' or cmd == 'pwok':
+        if cmd == 'qtxn':
+            # HSM mode: queue transaction to be signed, get back slot number
+            # - upload area is free again once this returns; collect w/ 'qtok'
+            txn_len, flags, txn_sha = unpack_from('<II32s', args)
+            if not hsm_active:
+                return b'err_HSM mode only'
+            if txn_sha != self.file_checksum.digest():
+                return b'err_Checksum'
+
+            from auth import queue_transaction, QUEUE_MAX_PSBT
+            assert 50 < txn_len <= QUEUE_MAX_PSBT, "badlen"
+
+            return queue_transaction(txn_len, (flags & STXN_FLAGS_MASK), txn_sha)
+
+        if cmd == 'qtok':
+            # Result of queued transaction, by slot number. Download the result
+            # (file number 2+slot) to free the slot; or ask again to give it up.
+            slot, = unpack_from('<I', args)
+            from auth import QueuedTransaction, QUEUE_SLOTS
+            assert 0 <= slot < QUEUE_SLOTS, 'bad slot'
+
+            req = QueuedTransaction.collect(slot)
+            if not req:
+                # STILL waiting
+                return None
+            if req.refused:
+                return b'refu'
+            if req.failed:
+                return b'err_' + req.failed.encode()
+
+            resp_len, sha = req.result
+            return pack('<4sI32s', 'strx', resp_len, sha)
+
+        if cmd == 'stok' or cmd == 'bkok' or cmd == 'smok' or cmd == 'pwok' or cmd == 'vaok':
             # Have we finished (whatever) the transaction,
             # which needed user approval? If so, provide result.
             from auth import UserAuthorizedAction
@@ -573,6 +619,13 @@ class USBHandler:
             chain = current_chain()
             return b'asci' + chain.ctype
 
+        if cmd == 'ptim':
+            # phase timings of most recent PSBT signing; simulator/dev builds only
+            import phases, ujson
+            if not phases.enabled():
+                return b'err_Not available'
+            return b'asci' + ujson.dumps(phases.last_report())
+
         if cmd == 'bagi':
             return self.handle_bag_number(args)
 
@@ -708,14 +761,24 @@ class USBHandler:
     async def handle_download(self, offset, length, file_number):
         # let them read from where we store the signed txn
         # - filenumber can be 0 or 1: uploaded txn, or result
+        # - or 2+N: result of queued txn in slot N (HSM mode)
+        from auth import QUEUE_SLOTS, QUEUE_SLOT_LEN, QUEUE_MAX_PSBT
 
         # limiting memory use here, should be MAX_BLK_LEN really
         length = min(length, MAX_BLK_LEN)
 
-        assert 0 <= file_number < 2, 'bad fnum'
-        assert 0 <= offset <= MAX_TXN_LEN, "bad offset"
+        assert 0 <= file_number < 2 + QUEUE_SLOTS, 'bad fnum'
         assert 1 <= length, 'len'
 
+        if file_number < 2:
+            assert 0 <= offset <= MAX_TXN_LEN, "bad offset"
+            pos = (MAX_TXN_LEN * file_number) + offset
+        else:
+            from auth import QueuedTransaction
+            assert QueuedTransaction.result_ready(file_number-2), 'not ready'
+            assert 0 <= offset <= QUEUE_SLOT_LEN - QUEUE_MAX_PSBT, "bad offset"
+            pos = MAX_TXN_LEN + ((file_number-2) * QUEUE_SLOT_LEN) + QUEUE_MAX_PSBT + offset
+
         # maintain a running SHA256 over what's sent
         if offset == 0:
             self.file_checksum = sha256()
@@ -724,13 +787,14 @@ class USBHandler:
         resp[0:4] = b'biny'
         buf = memoryview(resp)[4:]
 
-        pos = (MAX_TXN_LEN * file_number) + offset
-
         from glob import PSRAM
         PSRAM.read(pos, buf)
 
         self.file_checksum.update(buf)
 
+        if file_number >= 2:
+            QueuedTransaction.downloaded(file_number-2, offset + length)
+
         return resp
 
     async def handle_upload(self, offset, total_size, data):
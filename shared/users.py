@@ -200,55 +200,137 @@ class Users:
             return 'unknown user'
 
         auth_mode, secret, last_counter = u
-        secret = b32decode(secret)
 
-        if auth_mode == USER_AUTH_HMAC:
-            expect = hmac_sha256(secret, psbt_hash or bytes(32))
-            if expect != token:
-                return 'mismatch'
-
-            if last_counter == 0:
-                # using this as marker that they have successfully used the code once
-                cls.update_counter(username, 1)
-
-            return ''
-
-        if len(token) != 6:
-            return 'expect otp'
+        problem, cnt = check_token(auth_mode, b32decode(secret), last_counter,
+                                        token, totp_time, psbt_hash)
+        if not problem and cnt != last_counter:
+            cls.update_counter(username, cnt)
+
+        return problem
+
+def same_bytes(a, b):
+    # compare, taking same time wherever the first difference is
+    if len(a) != len(b):
+        return False
+    diff = 0
+    for x, y in zip(a, b):
+        diff |= x ^ y
+    return diff == 0
+
+def check_token(auth_mode, secret, last_counter, token, totp_time, psbt_hash, codes=None):
+    # check a password/totp against binary secret
+    # - codes: optional cache of {counter: expected code}, added to here
+    # - return (problem, new last_counter); problem is empty string if ok
+    if auth_mode == USER_AUTH_HMAC:
+        expect = hmac_sha256(secret, psbt_hash or bytes(32))
+        if not same_bytes(expect, token):
+            return 'mismatch', last_counter
+
+        # using 1 as marker that they have successfully used the code once
+        return '', (last_counter or 1)
+
+    if len(token) != 6:
+        return 'expect otp', last_counter
+
+    if auth_mode == USER_AUTH_HOTP:
+        # totp_time provided is ignored; use own counter; but perhaps
+        # they fumbled a bit and wasted a few codes, so give forward leeway
+        candidates = [last_counter+i for i in range(1, 10)]
+
+        if not last_counter:
+            candidates.append(0)
+    else:
+        # time based: try back a few slots, but only if not already used up
+        if totp_time < 52622505:
+            # above is time when I wrote the code, so must be after that
+            return 'range', last_counter
+
+        if totp_time <= last_counter:
+            return 'replay', last_counter
+
+        candidates = [(totp_time-i) for i in range(0, 3)
+                                if (totp_time-i) > last_counter]
+        if not candidates:
+            return 'replay', last_counter
+
+    # try them all, even after a match, so time taken doesn't say which one
+    found = None
+    for c in candidates:
+        expect = codes.get(c) if codes is not None else None
+        if expect is None:
+            expect = calc_hotp(secret, c).encode('ascii')
+            if codes is not None:
+                codes[c] = expect
+
+        #print('expect=%r got=%r cnt=%d last=%d' % (expect, token, c, last_counter))
+
+        if same_bytes(expect, token) and found is None:
+            found = c
+
+    if found is None:
+        return 'mismatch', last_counter
+
+    # success, need to update last counter level seen (especially for HOTP,
+    # but also to resist replay for TOTP)
+    return '', found
+
+class UserAuthCache:
+    # HSM mode: users' decoded secrets, and one-time codes already calculated,
+    # kept in RAM so each approval doesn't decode settings and redo the HMACs.
+    # Counter changes wait here until save(), then go to settings in one write.
+    def __init__(self):
+        self.users = {}         # username => [auth_mode, secret, last_counter, codes]
+        self.dirty = set()
+
+    def _get(self, username):
+        rv = self.users.get(username)
+        if rv is None:
+            u = Users.lookup(username)
+            if not u:
+                return None
+            rv = [u.auth_mode, b32decode(u.secret), u.last_counter, {}]
+            self.users[username] = rv
+        return rv
 
-        if auth_mode == USER_AUTH_HOTP:
-            # totp_time provided is ignored; use own counter; but perhaps
-            # they fumbled a bit and wasted a few codes, so give forward leeway
-            candidates = [last_counter+i for i in range(1, 10)]
+    def check(self, username, token, totp_time=None, psbt_hash=None):
+        # same as Users.auth_okay, but counter is updated by save() later
+        u = self._get(username)
+        if not u:
+            return 'unknown user'
 
-            if not last_counter:
-                candidates.append(0)
-        else:
-            # time based: try back a few slots, but only if not already used up
-            if totp_time < 52622505:
-                # above is time when I wrote the code, so must be after that
-                return 'range'
+        auth_mode, secret, last_counter, codes = u
+        problem, cnt = check_token(auth_mode, secret, last_counter,
+                                        token, totp_time, psbt_hash, codes)
+        if not problem and cnt != last_counter:
+            u[2] = cnt
+            self.dirty.add(username)
 
-            if totp_time <= last_counter:
-                return 'replay'
+            # codes at or below counter can never be used again
+            for c in [c for c in codes if c <= cnt]:
+                del codes[c]
 
-            candidates = [(totp_time-i) for i in range(0, 3)
-                                    if (totp_time-i) > last_counter]
-            if not candidates:
-                return 'replay'
+        return problem
 
-        for c in candidates:
-            expect = calc_hotp(secret, c).encode('ascii')
+    def save(self):
+        # write changed counters back to settings, all at once
+        if not self.dirty:
+            return
 
-            #print('expect=%r got=%r cnt=%d last=%d' % (expect, token, c, last_counter))
+        t = Users.get()
+        for username in self.dirty:
+            if username in t:
+                t[username][2] = self.users[username][2]
+        self.dirty.clear()
 
-            if expect == token:
-                # success, need to update last counter level seen (especially for HOTP,
-                # but also to resist replay for TOTP)
-                cls.update_counter(username, c)
-                return ''
+        settings.changed()
 
-        return 'mismatch'
+    def wipe(self):
+        # forget all secrets
+        from stash import blank_object
+        for u in self.users.values():
+            blank_object(u[1])
+            u[3].clear()
+        self.users.clear()
 
 ##
 ## Menu Stuff
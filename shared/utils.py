@@ -170,7 +170,8 @@ class Base64Writer:
         if self.runt:
             buf = self.runt + buf
         rl = len(buf) % 3
-        self.runt = buf[-rl:] if rl else b''
+        # copy: buf may be a memoryview over a re-used buffer
+        self.runt = bytes(buf[-rl:]) if rl else b''
         if rl < len(buf):
             tmp = b2a_base64(buf[:(-rl if rl else None)])
             # library puts in a newline, remove it
@@ -2,9 +2,9 @@
 #
 # wallet.py - A place you find UTXO, addresses and descriptors.
 #
-import chains
+import chains, ngu
 from descriptor import Descriptor
-from public_constants import AF_CLASSIC, AF_P2WPKH, AF_P2WPKH_P2SH
+from public_constants import AF_CLASSIC, AF_P2WPKH, AF_P2WPKH_P2SH, AFC_BECH32
 from stash import SensitiveValues
 
 MAX_BIP32_IDX = (2 ** 31) - 1
@@ -86,32 +86,75 @@ class MasterSingleSigWallet(WalletABC):
     def yield_addresses(self, start_idx, count, change_idx=None):
         # Render a range of addresses. Slow to start, since accesses SE in general
         # - if count==1, don't derive any subkey, just do path.
+        path = self.branch_path(change_idx)
+
+        if count is None:  # special case - showing single, ignoring start_idx
+            path = path[:-1]
+            with SensitiveValues() as sv:
+                node = sv.derive_path(path)
+                address = self.chain.address(node, self.addr_fmt)
+            yield 0, address, path
+            return
+
+        for idx, address in self.address_range(self.branch_node(path), start_idx, count):
+            yield idx, address, path+str(idx)
+
+    def branch_path(self, change_idx=None):
+        # path of the node that addresses are derived from, ending in slash
         path = self._path
         if change_idx is not None:
             assert 0 <= change_idx <= 1
             path += '/%d' % change_idx
 
+        return path + '/'
+
+    def branch_node(self, path):
+        # Public-only node for a branch: deriving below it needs no secrets,
+        # and there is nothing to blank after each address.
+        ch = self.chain
         with SensitiveValues() as sv:
             node = sv.derive_path(path)
-
-            if count is None:  # special case - showing single, ignoring start_idx
-                address = self.chain.address(node, self.addr_fmt)
-                yield 0, address, path
-                return
-
-            path += '/'
-            for idx in range(start_idx, start_idx+count):
-                if idx > MAX_BIP32_IDX:
-                    break
-                try:
-                    here = node.copy()
-                    here.derive(idx, False)            # works in-place
-                    address = self.chain.address(here, self.addr_fmt)
-                finally:
-                    here.blank()
-                    del here
-
-                yield idx, address, path+str(idx)
+            xpub = ch.serialize_public(node)
+
+        return ch.deserialize_node(xpub, AF_CLASSIC)
+
+    def address_range(self, node, start_idx, count):
+        # Bulk: contiguous run of addresses below one (public) branch node.
+        # - pubkey hash from C code; encoding w/o building a script per address
+        # - yields (idx, address)
+        ch = self.chain
+        af = self.addr_fmt
+        b58_encode = ngu.codecs.b58_encode
+        hash160 = ngu.hash.hash160
+
+        if af == AF_P2WPKH_P2SH:
+            # preallocated: redeem script, and version + script hash for base58
+            assert len(ch.b58_script) == 1
+            redeem = bytearray(b'\x00\x14' + bytes(20))
+            payload = bytearray(ch.b58_script + bytes(20))
+        elif af == AF_CLASSIC:
+            assert len(ch.b58_addr) == 1
+            ver = ch.b58_addr[0]
+        else:
+            assert af & AFC_BECH32
+            hrp = ch.bech32_hrp
+            segwit_encode = ngu.codecs.segwit_encode
+
+        end = min(start_idx + count, MAX_BIP32_IDX + 1)
+        for idx in range(start_idx, end):
+            here = node.copy()
+            here.derive(idx, False)            # works in-place
+
+            if af == AF_CLASSIC:
+                address = here.addr_help(ver)
+            elif af == AF_P2WPKH_P2SH:
+                redeem[2:22] = here.addr_help()
+                payload[1:21] = hash160(redeem)
+                address = b58_encode(payload)
+            else:
+                address = segwit_encode(hrp, 0, here.addr_help())
+
+            yield idx, address
 
     def render_address(self, change_idx, idx):
         # Optimized for a single address.
@@ -47,6 +47,9 @@ def pytest_addoption(parser):
                      help="Uses Q simulator when running 'login_settings_tests' module")
     parser.addoption("--headless", action="store_true", default=False,
                      help="Simulator is running in headless mode")
+    parser.addoption("--bench-sizes", default=None,
+                     help="test_bench.py: comma-separated list of PSBT sizes (# of ins/outs); "
+                          "benchmarks are skipped without it")
     # to make bitcoind produce psbt v2 one currently needs https://github.com/achow101/bitcoin/tree/psbt2
     # or wait until https://github.com/bitcoin/bitcoin/pull/21283 merged and released
 
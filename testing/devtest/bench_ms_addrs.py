@@ -0,0 +1,30 @@
+# (c) Copyright 2024 by Coinkite Inc. This file is covered by license found in COPYING-CC.
+#
+# bench_ms_addrs.py - measure multisig address generation rate
+#
+# this will run on the simulator; result is JSON
+# - uses first multisig wallet on file
+# - main.COUNT addresses, on external (0) branch
+#
+import gc, utime, main
+from ujson import dumps
+from multisig import MultisigWallet
+
+count = main.COUNT
+
+ms = MultisigWallet.get_by_idx(0)
+assert ms
+
+gc.collect()
+before = gc.mem_alloc()
+
+t0 = utime.ticks_us()
+n = 0
+for idx, addr, *_ in ms.yield_addresses(0, count, 0):
+    n += 1
+dt = utime.ticks_diff(utime.ticks_us(), t0)
+
+assert n == count
+
+RV.write(dumps(dict(M=ms.M, N=ms.N, addr_fmt=ms.addr_fmt, count=count, us=dt,
+                    per_sec=(count * 1000000) / dt, alloc=gc.mem_alloc()-before)))
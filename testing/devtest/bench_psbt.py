@@ -0,0 +1,80 @@
+# (c) Copyright 2024 by Coinkite Inc. This file is covered by license found in COPYING-CC.
+#
+# bench_psbt.py - measure time and heap used by each phase of PSBT signing
+#
+# this will run on the simulator; result is JSON
+# run manually with:
+#   execfile('../../testing/devtest/bench_psbt.py')
+#
+import gc, utime, main
+from ujson import dumps
+from psbt import psbtObject
+from sffile import SFFile
+from version import MAX_TXN_LEN
+
+fname = main.FILENAME
+
+tl = 0
+with SFFile(0, max_size=MAX_TXN_LEN) as wr_fd:
+    with open(fname, 'rb') as orig:
+        while 1:
+            here = orig.read(256)
+            if not here: break
+            wr_fd.write(here)
+            tl += len(here)
+
+phases = []
+peak = 0
+
+def sync(coro):
+    # run a coroutine that isn't expected to block (no UX needed)
+    try:
+        coro.send(None)
+    except StopIteration as exc:
+        return exc.value
+    raise RuntimeError('needs UX')
+
+def phase(name, fn, *args):
+    # - alloc: bytes allocated during phase (approx: under-reported if GC ran meanwhile)
+    # - retained: bytes still in use after phase, once garbage collected
+    global peak
+
+    gc.collect()
+    before = gc.mem_alloc()
+
+    t0 = utime.ticks_us()
+    rv = fn(*args)
+    dt = utime.ticks_diff(utime.ticks_us(), t0)
+
+    high = gc.mem_alloc()
+    gc.collect()
+    after = gc.mem_alloc()
+
+    peak = max(peak, high)
+    phases.append(dict(phase=name, us=dt, alloc=high-before, retained=after-before))
+
+    return rv
+
+def finalize(psbt):
+    with SFFile(MAX_TXN_LEN, max_size=MAX_TXN_LEN) as out_fd:
+        if psbt.is_complete():
+            psbt.finalize(out_fd)
+        else:
+            psbt.serialize(out_fd)
+
+rd_fd = SFFile(0, tl)
+
+psbt = phase('read_psbt', psbtObject.read_psbt, rd_fd)
+phase('validate', lambda: sync(psbt.validate()))
+phase('consider_inputs', psbt.consider_inputs)
+phase('consider_keys', psbt.consider_keys)
+phase('consider_outputs', psbt.consider_outputs)
+phase('consider_dangerous_sighash', psbt.consider_dangerous_sighash)
+phase('sign_it', psbt.sign_it)
+phase('finalize', finalize, psbt)
+
+RV.write(dumps(dict(num_inputs=psbt.num_inputs, num_outputs=psbt.num_outputs,
+                    psbt_len=tl, phases=phases, peak=peak, free=gc.mem_free())))
+
+del psbt
+rd_fd.close()
@@ -0,0 +1,56 @@
+# (c) Copyright 2024 by Coinkite Inc. This file is covered by license found in COPYING-CC.
+#
+# bench_ss_export.py - measure single-sig address export rate
+#
+# this will run on the simulator; result is JSON
+# - main.ADDR_FMT wallet, account zero, main.COUNT addresses on external branch
+# - times address generation alone, and whole CSV export (written to internal flash)
+#
+import gc, utime, main, os
+from ujson import dumps
+from uhashlib import sha256
+from wallet import MasterSingleSigWallet
+from address_explorer import generate_address_csv, CSV_CHUNK_ROWS
+
+count = main.COUNT
+addr_fmt = main.ADDR_FMT
+
+w = MasterSingleSigWallet(addr_fmt)
+
+gc.collect()
+t0 = utime.ticks_us()
+n = 0
+for idx, addr, *_ in w.yield_addresses(0, count, change_idx=0):
+    n += 1
+gen_us = utime.ticks_diff(utime.ticks_us(), t0)
+assert n == count
+
+# same path as make_address_summary_file, minus the UX; no ownership saver
+# since start != 0 (using index 1 vs. 0 makes no speed difference)
+gc.collect()
+before = gc.mem_alloc()
+t0 = utime.ticks_us()
+h = sha256()
+size = 0
+with open('bench.csv', 'wb') as fd:
+    rows = []
+    for part in generate_address_csv(None, addr_fmt, None, 0, count, start=1):
+        rows.append(part)
+        if len(rows) < CSV_CHUNK_ROWS:
+            continue
+        ep = ''.join(rows).encode()
+        fd.write(ep)
+        h.update(ep)
+        size += len(ep)
+        rows.clear()
+    ep = ''.join(rows).encode()
+    fd.write(ep)
+    h.update(ep)
+    size += len(ep)
+csv_us = utime.ticks_diff(utime.ticks_us(), t0)
+alloc = gc.mem_alloc() - before
+os.remove('bench.csv')
+
+RV.write(dumps(dict(addr_fmt=addr_fmt, count=count, gen_us=gen_us, csv_us=csv_us,
+                    per_sec=(count * 1000000) / gen_us, csv_per_sec=(count * 1000000) / csv_us,
+                    bytes=size, alloc=alloc)))
@@ -0,0 +1,95 @@
+# (c) Copyright 2024 by Coinkite Inc. This file is covered by license found in COPYING-CC.
+#
+# unit test for ownership cache file format
+# - v1.0 files are searched, then upgraded
+# - deeper caches are split into segment files
+# - several candidate wallets are generated in turns
+import struct
+from glob import settings
+from ownership import OWNERSHIP, AddressCacheFile, encode_addr, HASH_ENC_LEN, SEG_ADDRS
+from ownership import OWNERSHIP_MAGIC, OWNERSHIP_MAGIC_V1, OWNERSHIP_FILE_HDR, MAX_ADDRS_STORED
+from ownership import OWNERSHIP_FILE_HDR_LEN, BONUS_GAP_LIMIT
+from wallet import MasterSingleSigWallet
+from public_constants import AF_P2WPKH
+
+def read_hdr(fname):
+    with open(fname, 'rb') as fd:
+        return struct.unpack(OWNERSHIP_FILE_HDR, fd.read(OWNERSHIP_FILE_HDR_LEN))
+
+OWNERSHIP.wipe_all()
+
+w = MasterSingleSigWallet(AF_P2WPKH, account_idx=0)
+addrs = [a for _, a, *_ in w.yield_addresses(0, 30, change_idx=0)]
+
+# make a v1.0 file, with first 20 addresses
+f = AddressCacheFile(w, 0)
+with open(f.fname, 'wb') as fd:
+    fd.write(struct.pack(OWNERSHIP_FILE_HDR, OWNERSHIP_MAGIC_V1, 0, 0))
+    for a in addrs[0:20]:
+        fd.write(encode_addr(a, f.salt)[0:HASH_ENC_LEN])
+
+f = AddressCacheFile(w, 0)
+assert f.legacy
+assert f.count == 20
+
+# found in old file, which is left alone
+wal, path = OWNERSHIP.search(addrs[5])
+assert path == (0, 5), path
+assert AddressCacheFile(w, 0).legacy
+
+# beyond old file: regenerated in new format
+wal, path = OWNERSHIP.search(addrs[25])
+assert path == (0, 25), path
+
+f = AddressCacheFile(w, 0)
+assert not f.legacy
+assert read_hdr(f.seg_fname(0)) == (OWNERSHIP_MAGIC, 0, HASH_ENC_LEN)
+assert 25 < f.count <= MAX_ADDRS_STORED
+assert len(f.segs) == 1
+
+# and now found via bloom filter and records
+for idx in (0, 5, 25):
+    assert (0, idx) in list(f.fast_search(addrs[idx])), idx
+
+# deeper cache, longer records: second segment needed
+OWNERSHIP.wipe_all()
+settings.set('aocd', SEG_ADDRS + 40)
+settings.set('aohl', 4)
+try:
+    deep = SEG_ADDRS + 10
+    want = [a for _, a, *_ in w.yield_addresses(deep, 1, change_idx=0)][0]
+
+    wal, path = OWNERSHIP.search(want)
+    assert path == (0, deep), path
+
+    f = AddressCacheFile(w, 0)
+    assert f.segs[0] == (4, SEG_ADDRS), f.segs
+    assert f.segs[1] == (4, f.count - SEG_ADDRS), f.segs
+    assert f.count == deep + BONUS_GAP_LIMIT
+    assert read_hdr(f.seg_fname(1)) == (OWNERSHIP_MAGIC, 0, 4)
+
+    assert list(f.fast_search(want)) == [(0, deep)]
+    assert (0, 5) in list(f.fast_search(addrs[5]))
+finally:
+    settings.remove_key('aocd')
+    settings.remove_key('aohl')
+    OWNERSHIP.wipe_all()
+
+# several wallets: generated in turns, and all keep what they made
+settings.set('accts', [[AF_P2WPKH, 5]])
+try:
+    w5 = MasterSingleSigWallet(AF_P2WPKH, account_idx=5)
+    want = [a for _, a, *_ in w5.yield_addresses(30, 1, change_idx=1)][0]
+
+    wal, path = OWNERSHIP.search(want)
+    assert wal.name == w5.name
+    assert path == (1, 30), path
+
+    # others did not run to full depth first
+    for ww in (w, w5):
+        for chg in (0, 1):
+            f = AddressCacheFile(ww, chg)
+            assert 0 < f.count < MAX_ADDRS_STORED, (ww.name, chg, f.count)
+finally:
+    settings.remove_key('accts')
+    OWNERSHIP.wipe_all()
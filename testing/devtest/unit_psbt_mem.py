@@ -0,0 +1,40 @@
+# (c) Copyright 2024 by Coinkite Inc. This file is covered by license found in COPYING-CC.
+#
+# measure heap used by a parsed PSBT (the in-memory proxy objects)
+#
+# this will run on the simulator
+# run manually with:
+#   execfile('../../testing/devtest/unit_psbt_mem.py')
+
+import gc, main
+from ujson import dumps
+from psbt import psbtObject
+from version import MAX_TXN_LEN
+from sffile import SFFile
+
+fname = main.FILENAME
+
+tl = 0
+with SFFile(0, max_size=MAX_TXN_LEN) as wr_fd:
+    with open(fname, 'rb') as orig:
+        while 1:
+            here = orig.read(256)
+            if not here: break
+            wr_fd.write(here)
+            tl += len(here)
+
+rd_fd = SFFile(0, tl)
+
+gc.collect()
+before = gc.mem_alloc()
+
+obj = psbtObject.read_psbt(rd_fd)
+
+gc.collect()
+used = gc.mem_alloc() - before
+
+RV.write(dumps(dict(num_inputs=obj.num_inputs, num_outputs=obj.num_outputs,
+                    used=used, free=gc.mem_free())))
+
+del obj
+rd_fd.close()
@@ -222,6 +222,7 @@ def test_applications_samourai(chain, change, option, goto_address_explorer, cap
 
 @pytest.mark.parametrize('start_idx, press_seq, expected_start, expected_n', [
     (0, ['9', '9', '9', '7', '7', '9'], 20, 10), # forward backward forward
+    (0, ['9', '7', '9', '7', '9', '9', '9', '9', '9'], 50, 10), # cached pages, then past cache
     (0, [], 0, 10), # initial
     (0, ['7', '7', '7'], 0, 10), # cannot go past 0
     (0, ['7', '7', '9'], 10, 10), # backwards at start is idempotent
@@ -0,0 +1,132 @@
+# (c) Copyright 2024 by Coinkite Inc. This file is covered by license found in COPYING-CC.
+#
+# Benchmarks for PSBT handling: parse, validate, sign and finalize phases, run
+# inside the simulator. Not a correctness test: see test_sign.py for that.
+# Also: multisig address generation rate, and single-sig address export rate.
+#
+# Results are appended (one JSON object per line) to debug/bench-psbt.json
+# so they can be compared across firmware versions.
+#
+# Skipped unless sizes are given:
+#
+#   pytest test_bench.py -s --bench-sizes 10,100,500,2000
+#
+import pytest, json, time
+from constants import SIGHASH_MAP, AF_CLASSIC, AF_P2WPKH, AF_P2WPKH_P2SH, addr_fmt_names
+
+pytestmark = pytest.mark.bench
+
+@pytest.fixture(autouse=True)
+def only_if_asked(pytestconfig):
+    if pytestconfig.getoption('bench_sizes') is None:
+        raise pytest.skip('benchmark: needs --bench-sizes')
+
+
+def save(kind, size, rv):
+    rv.update(kind=kind, size=size, when=int(time.time()))
+
+    with open('debug/bench-psbt.json', 'at') as fd:
+        fd.write(json.dumps(rv) + '\n')
+
+def record(kind, size, rv):
+    save(kind, size, rv)
+
+    print("%s x %d: peak heap %d" % (kind, size, rv['peak']))
+    for ph in rv['phases']:
+        print("  %-28s %10.1fms  alloc %8d  retained %8d" % (
+                    ph['phase'], ph['us'] / 1000, ph['alloc'], ph['retained']))
+
+@pytest.fixture
+def bench_sizes(pytestconfig):
+    return [int(i) for i in pytestconfig.getoption('bench_sizes').split(',')]
+
+@pytest.fixture
+def run_bench(sim_exec, sim_execfile):
+    def doit(kind, size, psbt):
+        fn = 'debug/bench-%s-%d.psbt' % (kind, size)
+        open(fn, 'wb').write(psbt)
+
+        sim_exec('import main; main.FILENAME = %r; ' % ('../../testing/'+fn))
+        rv = sim_execfile('devtest/bench_psbt.py', timeout=None)
+        assert rv[0] == '{', rv
+
+        rv = json.loads(rv)
+        assert rv['num_inputs'] == size
+
+        record(kind, size, rv)
+
+        return rv
+
+    return doit
+
+@pytest.mark.parametrize('segwit', [False, True])
+def test_bench_singlesig(segwit, bench_sizes, fake_txn, run_bench, dev):
+    # P2PKH or P2WPKH inputs
+    for size in bench_sizes:
+        psbt = fake_txn(size, size, dev.master_xpub, segwit_in=segwit)
+        run_bench('p2wpkh' if segwit else 'p2pkh', size, psbt)
+
+def test_bench_mixed_sighash(bench_sizes, fake_txn, run_bench, dev, settings_set):
+    # P2WPKH inputs, cycling thru all the sighash values
+    settings_set('sighshchk', 1)
+    shs = list(SIGHASH_MAP.values())
+
+    def hack(psbt):
+        for idx, inp in enumerate(psbt.inputs):
+            inp.sighash = shs[idx % len(shs)]
+
+    try:
+        for size in bench_sizes:
+            psbt = fake_txn(size, size, dev.master_xpub, segwit_in=True, psbt_hacker=hack)
+            run_bench('mixed-sighash', size, psbt)
+    finally:
+        settings_set('sighshchk', 0)
+
+def test_bench_multisig(bench_sizes, clear_ms, import_ms_wallet, fake_ms_txn, run_bench):
+    # 2-of-3 P2SH-P2WSH inputs
+    clear_ms()
+    keys = import_ms_wallet(2, 3, addr_fmt='p2wsh-p2sh', name='bench', accept=True)
+
+    for size in bench_sizes:
+        psbt = fake_ms_txn(size, size, 2, keys, segwit_in=True, outstyles=['p2wsh'])
+        run_bench('p2sh-p2wsh', size, psbt)
+
+    clear_ms()
+
+@pytest.mark.parametrize('M_N', [(2, 3), (11, 15)])
+@pytest.mark.parametrize('addr_fmt', ['p2wsh', 'p2sh'])
+def test_bench_ms_addresses(M_N, addr_fmt, bench_sizes, clear_ms, import_ms_wallet,
+                            sim_exec, sim_execfile):
+    # addresses/second, as used by CSV export and ownership cache builds
+    M, N = M_N
+    clear_ms()
+    import_ms_wallet(M, N, addr_fmt=addr_fmt, name='bench', accept=True)
+
+    for size in bench_sizes:
+        sim_exec('import main; main.COUNT = %d' % size)
+        rv = sim_execfile('devtest/bench_ms_addrs.py', timeout=None)
+        assert rv[0] == '{', rv
+
+        rv = json.loads(rv)
+        assert rv['count'] == size
+
+        save('ms-addrs-%s-%dof%d' % (addr_fmt, M, N), size, rv)
+        print("%d-of-%d %s x %d: %.1f addr/sec" % (M, N, addr_fmt, size, rv['per_sec']))
+
+    clear_ms()
+
+@pytest.mark.parametrize('addr_fmt', [AF_CLASSIC, AF_P2WPKH, AF_P2WPKH_P2SH])
+def test_bench_ss_export(addr_fmt, sim_exec, sim_execfile, count=10000):
+    # addresses/second for a big address explorer CSV export
+    sim_exec('import main; main.COUNT = %d; main.ADDR_FMT = %d' % (count, addr_fmt))
+    rv = sim_execfile('devtest/bench_ss_export.py', timeout=None)
+    assert rv[0] == '{', rv
+
+    rv = json.loads(rv)
+    assert rv['count'] == count
+
+    save('ss-export-%s' % addr_fmt_names[addr_fmt], count, rv)
+    print("%s x %d: %.1f addr/sec, %.1f rows/sec to CSV (%d bytes)" % (
+            addr_fmt_names[addr_fmt], count, rv['per_sec'], rv['csv_per_sec'], rv['bytes']))
+
+# EOF
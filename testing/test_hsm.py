@@ -12,7 +12,7 @@
 # - create development firmware via `make dev`
 # - enable HSM commands in `Advanced/Tools -> Enable HSM -> Enable`
 #
-import pytest, time, itertools, base64, re, json, struct, io
+import pytest, time, itertools, base64, re, json, struct, io, os
 from collections import OrderedDict
 from binascii import b2a_hex, a2b_base64
 from base64 import b32encode
@@ -27,7 +27,7 @@ from msg import sign_message
 from bip32 import PrivateKey
 from ckcc_protocol.constants import *
 from ckcc_protocol.protocol import CCProtocolPacker
-from ckcc_protocol.protocol import CCUserRefused, CCProtoError
+from ckcc_protocol.protocol import CCUserRefused, CCProtoError, CCBusyError
 from ckcc_protocol.utils import calc_local_pincode
 from ctransaction import CTransaction, CTxOut
 
@@ -650,6 +650,27 @@ def test_whitelist_multi(dev, start_hsm, tweak_rule, attempt_psbt, fake_txn, amo
         assert nwl == dest
         assert nwl in dests
 
+def test_whitelist_other_chain(dev, start_hsm, tweak_rule, attempt_psbt, fake_txn, amount=5E6):
+    # whitelist is matched by scriptPubKey; same script, but address for another
+    # chain, is not a match
+    start_hsm(DICT(rules=[dict(whitelist=[EXAMPLE_ADDRS[0]])]))
+
+    for style in ['p2wpkh', 'p2pkh', 'p2wsh-p2sh']:
+        dests = []
+        psbt = fake_txn(1, 2, dev.master_xpub,
+                            outstyles=[style, 'p2wpkh'],
+                            outvals=[amount, 1E8-amount], change_outputs=[1], fee=0,
+                            capture_scripts=dests)
+
+        mainnet = render_address(dests[0], testnet=False)
+        tweak_rule(0, dict(whitelist=[mainnet]))
+        msg = attempt_psbt(psbt, "non-whitelisted")
+        # error shows the (testnet) address actually used
+        assert msg.endswith(render_address(dests[0]))
+
+        tweak_rule(0, dict(whitelist=[mainnet, render_address(dests[0])]))
+        attempt_psbt(psbt)
+
 def test_whitelist_invalid_attestation(start_hsm, attempt_psbt, fake_txn):
     ID = b"COINKITE"
     SUBTYPE = 0
@@ -774,6 +795,95 @@ def test_multiple_signings(dev, quick_start_hsm, is_simulator,
         attempt_psbt(psbt)
 
 
+def test_queued_signings(dev, quick_start_hsm, fake_txn, load_hsm_users, auth_user,
+                         start_sign, hsm_status):
+    # several PSBTs queued at once, signed back-to-back, collected per slot
+    policy = DICT(warnings_ok=True, rules=[dict(users=['pw'])])
+    load_hsm_users()
+    quick_start_hsm(policy)
+
+    before = hsm_status()
+    psbts = [fake_txn(2, 2, dev.master_xpub, change_outputs=[0]) for i in range(4)]
+    slots = []
+    for n, psbt in enumerate(psbts):
+        if n != 2:
+            # approvals are captured when queued; third one has none
+            auth_user.psbt_hash = sha256(psbt).digest()
+            auth_user('pw')
+        ll, sha = dev.upload_file(psbt)
+        slots.append(dev.send_recv(b'qtxn' + struct.pack('<II32s', ll, 0, sha)))
+
+    assert sorted(slots) == [0, 1, 2, 3]
+
+    # queue full, and stxn would overwrite it
+    with pytest.raises(CCBusyError):
+        dev.send_recv(b'qtxn' + struct.pack('<II32s', ll, 0, sha))
+    with pytest.raises(CCBusyError):
+        start_sign(psbts[0])
+
+    for n, (psbt, slot) in enumerate(zip(psbts, slots)):
+        done = None
+        try:
+            while done == None:
+                time.sleep(0.050)
+                done = dev.send_recv(b'qtok' + struct.pack('<I', slot), timeout=None)
+        except CCUserRefused:
+            assert n == 2
+            continue
+
+        assert n != 2
+        resp_len, chk = done
+        out = dev.download_file(resp_len, chk, file_number=2+slot)
+        assert out[0:5] == b'psbt\xff'
+        assert out != psbt
+
+    after = hsm_status()
+    assert after.approvals == before.approvals + 3
+    assert after.refusals == before.refusals + 1
+    assert 'need user(s) confirmation' in after.last_refusal
+
+    # all collected, so slots are empty now
+    with pytest.raises(CCProtoError, match='empty slot'):
+        dev.send_recv(b'qtok' + struct.pack('<I', 0))
+
+def test_queued_slot_reuse(dev, quick_start_hsm, fake_txn):
+    # queue another between reporting a result and downloading it: result intact
+    quick_start_hsm(DICT(warnings_ok=True, rules=[{}]))
+
+    def queue(psbt):
+        ll, sha = dev.upload_file(psbt)
+        return dev.send_recv(b'qtxn' + struct.pack('<II32s', ll, 0, sha))
+
+    def wait(slot):
+        done = None
+        while done == None:
+            time.sleep(0.050)
+            done = dev.send_recv(b'qtok' + struct.pack('<I', slot), timeout=None)
+        return done
+
+    a = queue(fake_txn(2, 2, dev.master_xpub, change_outputs=[0]))
+    a_len, a_chk = wait(a)
+
+    # still reserved, so next one goes elsewhere; let it be signed
+    b = queue(fake_txn(5, 5, dev.master_xpub, change_outputs=[0]))
+    assert b != a
+    b_len, b_chk = wait(b)
+
+    # checks sha256 of what's downloaded
+    out = dev.download_file(a_len, a_chk, file_number=2+a)
+    assert out[0:5] == b'psbt\xff'
+    dev.download_file(b_len, b_chk, file_number=2+b)
+
+    # now free again
+    assert queue(fake_txn(1, 1, dev.master_xpub)) == min(a, b)
+    c_len, c_chk = wait(min(a, b))
+
+    # asking twice, instead of downloading, gives up the slot
+    with pytest.raises(CCProtoError, match='released'):
+        dev.send_recv(b'qtok' + struct.pack('<I', min(a, b)))
+    with pytest.raises(CCProtoError, match='empty slot'):
+        dev.send_recv(b'qtok' + struct.pack('<I', min(a, b)))
+
 @pytest.mark.veryslow
 @pytest.mark.parametrize("cc_first", [True, False])
 @pytest.mark.parametrize("M_N", [(2,3), (3,5), (15,15)])
@@ -949,6 +1059,59 @@ def test_must_log(dev, start_hsm, sd_cards_eject, attempt_msg_sign, fake_txn, at
         attempt_msg_sign(None, b'hello', 'm', addr_fmt=AF_CLASSIC)
         attempt_psbt(psbt)
 
+@pytest.mark.parametrize('must_log', [True, False])
+def test_log_entries(must_log, dev, start_hsm, fake_txn, attempt_psbt, microsd_path, sim_exec):
+    # card stays mounted, entries numbered and written in order
+    policy = DICT(must_log=must_log, rules=[{}])
+
+    start_hsm(policy)
+
+    psbt = fake_txn(1, 1, dev.master_xpub)
+    fn = microsd_path('psbt/%s.log' % b2a_hex(sha256(psbt).digest()[-8:]).decode())
+    try:
+        os.remove(fn)
+    except FileNotFoundError:
+        pass
+
+    for i in range(3):
+        attempt_psbt(psbt)
+
+    if not must_log:
+        # batched; push them out now
+        sim_exec('from glob import hsm_active; hsm_active.log_writer.flush()')
+
+    log = open(fn, 'rt').read()
+    nums = [int(n) for n in re.findall(r'^Entry #(\d+)$', log, re.M)]
+    assert len(nums) == 3
+    assert nums == sorted(nums)
+    assert log.count('APPROVED: ') == 3
+
+def test_log_virtdisk(dev, start_hsm, fake_txn, attempt_psbt, sd_cards_eject, sim_exec,
+                      sim_eval, settings_set, needs_virtdisk, is_simulator):
+    # no card, so log goes onto virtual disk; that must not stay mounted (turns off USB)
+    if not is_simulator():
+        raise pytest.skip("needs card ejected")
+
+    settings_set('vidsk', 1)
+    sim_exec('import glob, vdisk; glob.VD or vdisk.VirtDisk()')
+    sd_cards_eject(1)
+
+    try:
+        start_hsm(DICT(rules=[{}]))
+
+        for i in range(2):
+            attempt_psbt(fake_txn(1, 1, dev.master_xpub))
+            assert sim_eval('glob.hsm_active.log_writer.card') == 'None'
+
+        # after the delayed flush too
+        time.sleep(2.5)
+        assert sim_eval('glob.hsm_active.log_writer.card') == 'None'
+        attempt_psbt(fake_txn(1, 1, dev.master_xpub))
+    finally:
+        sd_cards_eject(0)
+        sim_exec('import glob; glob.VD and glob.VD.shutdown()')
+        settings_set('vidsk', 0)
+
 def test_never_log(dev, start_hsm, attempt_msg_sign, fake_txn, attempt_psbt, sd_cards_eject):
     # never try to log anything
     policy = DICT(never_log=True, msg_paths=['m'], rules=[{}])
@@ -1295,6 +1458,33 @@ def test_patterns(pattern, dev, start_hsm, fake_txn, attempt_psbt):
         psbt = fake_txn(1, 2, invals = [2000], outvals = [1000, 1000], fee = 0)
         attempt_psbt(psbt) # all output amounts are equal
 
+def test_many_rules(dev, start_hsm, tweak_rule, fake_txn, attempt_psbt):
+    # all rules judged from one look at the txn; each fails for its own reason
+    junk = EXAMPLE_ADDRS[0]
+    rules = [
+        dict(whitelist=[junk]),
+        dict(max_amount=10),
+        dict(patterns=['EQ_NUM_INS_OUTS']),
+        dict(patterns=['EQ_OUT_AMOUNTS']),
+        dict(min_pct_self_transfer=99.0),
+        dict(wallet='1', whitelist=[junk], whitelist_opts=dict(mode="ATTEST")),
+    ]
+    start_hsm(DICT(rules=rules))
+
+    psbt = fake_txn(1, 3, invals=[3000], outvals=[1000, 1500, 500], change_outputs=[2], fee=0)
+    msg = attempt_psbt(psbt, 'Rejected: ')
+
+    for expect in ['rule #1: non-whitelisted address', 'rule #2: amount exceeded',
+                    'rule #3: unequal number of inputs and outputs',
+                    'rule #4: not all output amounts are equal',
+                    'rule #5: does not meet self transfer threshold',
+                    'rule #6: missing attestation for output 0']:
+        assert expect in msg
+
+    # last one is easy
+    tweak_rule(5, dict(max_amount=5000))
+    attempt_psbt(psbt)
+
 def test_user_subset(dev, start_hsm, tweak_rule, load_hsm_users, fake_txn, attempt_psbt, auth_user):
     psbt = fake_txn(1,1, dev.master_xpub)
     auth_user.psbt_hash = sha256(psbt).digest()
@@ -1326,6 +1516,31 @@ def test_user_subset(dev, start_hsm, tweak_rule, load_hsm_users, fake_txn, attem
             auth_user(name, do_replay=True)
             attempt_psbt(psbt, 'replay' if name == 'totp' else 'mismatch')
 
+def test_user_counters(dev, start_hsm, load_hsm_users, fake_txn, attempt_psbt, auth_user, sim_eval):
+    # counters for several users, all saved after one approval; then replay fails
+    psbt = fake_txn(1,1, dev.master_xpub)
+    auth_user.psbt_hash = sha256(psbt).digest()
+
+    policy = DICT(rules=[dict(users=['totp', 'hotp', 'pw'])])
+    load_hsm_users()
+    start_hsm(policy)
+
+    tt = auth_user.tt
+    for name in ['totp', 'hotp', 'pw']:
+        auth_user(name)
+    attempt_psbt(psbt)
+
+    cnts = eval(sim_eval("{k: v[2] for k,v in settings.get('usr').items()}"))
+    assert cnts['totp'] == tt
+    assert cnts['hotp'] > 0
+    assert cnts['pw'] == 1
+
+    auth_user('totp', do_replay=True)
+    auth_user('hotp')
+    auth_user('pw')
+    msg = attempt_psbt(psbt, 'wrong auth')
+    assert 'replay' in msg
+
 def test_min_users_parse(dev, start_hsm, tweak_rule, load_hsm_users, 
                             auth_user, sim_exec, readback_rule):
 
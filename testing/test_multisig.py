@@ -339,6 +339,23 @@ def import_ms_wallet(dev, make_multisig, offer_ms_import, press_select,
     return doit
 
 
+def test_ms_check_registry(dev, clear_ms, import_ms_wallet):
+    # msck answers from index of saved wallets; must follow imports and deletes
+    clear_ms()
+    k1 = import_ms_wallet(2, 3, name='reg-a', accept=True, addr_fmt=AF_P2WSH)
+    k2 = import_ms_wallet(3, 5, name='reg-b', accept=True, addr_fmt=AF_P2SH)
+
+    for M, N, keys in [(2, 3, k1), (3, 5, k2)]:
+        xor = 0
+        for xfp, _, _ in keys:
+            xor ^= xfp
+        assert dev.send_recv(CCProtocolPacker.multisig_check(M, N, xor)) == 1
+        assert dev.send_recv(CCProtocolPacker.multisig_check(M, N, xor ^ 1)) == 0
+        assert dev.send_recv(CCProtocolPacker.multisig_check(N, N, xor)) == 0
+
+    clear_ms()
+    assert dev.send_recv(CCProtocolPacker.multisig_check(2, 3, xor)) == 0
+
 @pytest.mark.parametrize('N', [ 3, 15])
 def test_ms_import_variations(N, make_multisig, offer_ms_import, press_cancel, is_q1):
     # all the different ways...
@@ -1473,6 +1490,33 @@ def test_ms_sign_simple(M_N, num_ins, dev, addr_fmt, clear_ms, incl_xpubs, impor
     else:
         try_sign(psbt)
 
+@pytest.mark.veryslow
+@pytest.mark.unfinalized
+@pytest.mark.parametrize('addr_fmt', [AF_P2SH, AF_P2WSH])
+@pytest.mark.parametrize('num_ins', [10, 100, 300])
+def test_ms_speed_per_input(num_ins, addr_fmt, dev, clear_ms, import_ms_wallet,
+                            fake_ms_txn, start_sign, end_sign):
+    # 2-of-3 consolidation: every input's script is checked against the wallet,
+    # which needs co-signer xpubs parsed and their branch derived just once
+    clear_ms()
+    keys = import_ms_wallet(2, 3, name='speed', accept=True, addr_fmt=addr_fmt)
+
+    psbt = fake_ms_txn(num_ins, 1, 2, keys, outstyles=ADDR_STYLES_MS, change_outputs=[0])
+    open('debug/ms-speed.psbt', 'wb').write(psbt)
+
+    dt = time.time()
+    start_sign(psbt)
+    end_sign(accept=True)
+    ready_time = time.time() - dt
+
+    # time spent in each phase, from the simulator itself
+    rv = json.loads(dev.send_recv(b'ptim', timeout=None))
+    ph = {p['name']: p['us'] for p in rv['phases']}
+
+    print("2-of-3 %s, %d inputs: %.1fs => %.1fms/input (validate %.1fms/input)" % (
+            addr_fmt_names[addr_fmt], num_ins, ready_time, ready_time * 1000 / num_ins,
+            (ph['validate'] + ph['inputs']) / 1000 / num_ins))
+
 @pytest.mark.unfinalized
 @pytest.mark.bitcoind
 @pytest.mark.parametrize('num_ins', [ 15 ])
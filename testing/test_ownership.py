@@ -151,6 +151,13 @@ def test_positive(addr_fmt, offset, subaccount, testnet, from_empty, change_idx,
 
     assert got_path == (change_idx, offset)
 
+def test_file_format(unit_test, use_testnet, settings_set):
+    # v1.0 cache files still work, and get replaced by current format;
+    # deeper caches span several segment files
+    use_testnet(False)
+    settings_set('accts', [])
+    unit_test('devtest/unit_ownership.py')
+
 @pytest.mark.parametrize('valid', [ True, False] )
 @pytest.mark.parametrize('testnet', [ True, False] )
 @pytest.mark.parametrize('method', [ 'qr', 'nfc'] )
@@ -287,4 +294,85 @@ def test_address_explorer_saver(af, wipe_cache, settings_set, goto_address_explo
     else:
         assert af in story
 
+def test_verify_batch(dev, wipe_cache, use_testnet, settings_set, clear_ms):
+    # many addresses in one go, over USB: CSV results file back
+    from struct import pack
+    from bech32 import encode as bech32_encode
+
+    use_testnet(False)
+    clear_ms()
+    wipe_cache()
+    settings_set('accts', [])
+
+    mk = BIP32Node.from_wallet_key(simulator_fixed_xprv)
+    want = {}
+    for path in ["m/44h/0h/0h/0/3", "m/44h/0h/0h/0/25", "m/84h/0h/0h/1/5", "m/84h/0h/0h/0/0"]:
+        sk = mk.subkey_for_path(path[2:].replace('h', "'"))
+        if path.startswith('m/44h'):
+            addr = sk.address(netcode="BTC")
+        else:
+            addr = bech32_encode('bc', 0, sk.hash160())
+        want[addr] = path
+
+    fake = fake_address(AF_P2WPKH, False)
+    wrong_net = fake_address(AF_CLASSIC, True)
+
+    lines = ['# list of addresses', ''] + list(want) + [fake, wrong_net, list(want)[0]]
+    file_len, sha = dev.upload_file('\n'.join(lines).encode())
+
+    dev.send_recv(b'vadr' + pack('<I32s', file_len, sha))
+
+    done = None
+    while done is None:
+        time.sleep(0.050)
+        done = dev.send_recv(b'vaok', timeout=None)
+
+    resp_len, chk = done
+    body = dev.download_file(resp_len, chk).decode()
+
+    rows = list(csv.reader(io.StringIO(body)))
+    assert rows[0] == ['Address', 'Wallet', 'Derivation', 'Error']
+    rows = rows[1:]
+    assert len(rows) == len(want) + 3
+
+    for addr, wallet, path, err in rows:
+        if addr in want:
+            assert path == want[addr]
+            assert not err
+        elif addr == fake:
+            assert 'without finding a match' in err
+            assert not wallet
+        else:
+            assert addr == wrong_net
+            assert 'not valid on Bitcoin Mainnet' in err
+
+def test_prewarm(sim_exec, settings_set, settings_remove, wipe_cache, goto_home, use_testnet,
+                 clear_ms):
+    # background task fills caches for all known wallets, once idle at a menu
+    use_testnet(False)
+    clear_ms()
+    wipe_cache()
+    settings_set('accts', [])
+    settings_set('aocd', 30)
+    settings_set('aobg', 1)
+    goto_home()
+
+    try:
+        # idle period, then a poll or two to generate 30 addresses per branch
+        time.sleep(30 + 15)
+
+        cmd = 'from ownership import OWNERSHIP; RV.write(repr([(f.wallet.name, '\
+                'f.change_idx, f.count) for f in OWNERSHIP.prewarm_candidates()]))'
+        got = sim_exec(cmd)
+        assert 'Traceback' not in got, got
+        got = eval(got)
+    finally:
+        settings_remove('aobg')
+        settings_remove('aocd')
+        wipe_cache()
+
+    assert len(got) == 6        # 3 single-sig types, external and change
+    for name, change_idx, count in got:
+        assert count == 30, (name, change_idx)
+
 # EOF
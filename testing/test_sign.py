@@ -3,7 +3,7 @@
 # Transaction Signing. Important.
 #
 
-import time, pytest, os, random, pdb, struct, base64, binascii, itertools, datetime
+import time, pytest, os, random, pdb, struct, base64, binascii, itertools, datetime, json
 from ckcc_protocol.protocol import CCProtocolPacker, CCProtoError, MAX_TXN_LEN, CCUserRefused
 from binascii import b2a_hex, a2b_hex
 from psbt import BasicPSBT, BasicPSBTInput, BasicPSBTOutput, PSBT_IN_REDEEM_SCRIPT
@@ -132,6 +132,25 @@ def test_psbt_proxy_parsing(fn, sim_execfile, sim_exec):
     rb = BasicPSBT().parse(open(rb, 'rb').read())
     assert oo == rb
 
+@pytest.mark.parametrize('num_ins, num_outs', [(10, 1000), (100, 100), (250, 10)])
+def test_psbt_memory_use(num_ins, num_outs, fake_txn, sim_exec, sim_execfile):
+    # memory benchmark: heap used by parsed PSBT, and so roughly how many
+    # inputs/outputs would fit before "Transaction is too complex"
+    psbt = fake_txn(num_ins, num_outs, segwit_in=True)
+
+    fn = 'debug/memory-use.psbt'
+    open(fn, 'wb').write(psbt)
+
+    sim_exec('import main; main.FILENAME = %r; ' % ('../../testing/'+fn))
+    rv = json.loads(sim_execfile('devtest/unit_psbt_mem.py'))
+
+    assert rv['num_inputs'] == num_ins
+    assert rv['num_outputs'] == num_outs
+
+    per_item = rv['used'] / (num_ins + num_outs)
+    print("%d ins, %d outs: %d bytes used => %.0f bytes/item, room for ~%d more" % (
+            num_ins, num_outs, rv['used'], per_item, rv['free'] // per_item))
+
 @pytest.mark.unfinalized
 def test_speed_test(dev, fake_txn, is_mark3, is_mark4, start_sign, end_sign,
                     press_select):
@@ -170,6 +189,63 @@ def test_speed_test(dev, fake_txn, is_mark3, is_mark4, start_sign, end_sign,
     print("  Tx time: %.1f" % tx_time)
     print("Sign time: %.1f" % ready_time)
 
+@pytest.mark.unfinalized
+@pytest.mark.parametrize('segwit', [True, False])
+@pytest.mark.parametrize('num_in', [10, 100])
+def test_speed_per_input(num_in, segwit, dev, fake_txn, start_sign, press_select):
+    # measure signing time per input, when all inputs share a parent derivation path
+    # - parent node derived once, then one step per input
+    psbt = fake_txn(num_in, 2, dev.master_xpub, segwit_in=segwit)
+
+    open('debug/speed-per-input.psbt', 'wb').write(psbt)
+    start_sign(psbt, finalize=False)
+    press_select(timeout=None)
+
+    dt = time.time()
+    done = None
+    while done == None:
+        time.sleep(0.05)
+        done = dev.send_recv(CCProtocolPacker.get_signed_txn(), timeout=None)
+
+    ready_time = time.time() - dt
+
+    print("%d %s inputs: %.1fs => %.1fms/input" % (
+            num_in, "segwit" if segwit else "legacy", ready_time, ready_time * 1000 / num_in))
+
+@pytest.mark.parametrize('finalize', [False, True])
+def test_phase_timing(finalize, dev, fake_txn, start_sign, end_sign):
+    # phase-level timing and heap use of the last signing, over USB
+    psbt = fake_txn(5, 2, dev.master_xpub, segwit_in=True, change_outputs=[1])
+
+    start_sign(psbt, finalize=finalize)
+    end_sign(accept=True, finalize=finalize)
+
+    rv = json.loads(dev.send_recv(b'ptim', timeout=None))
+    assert rv['label'] == 'psbt'
+    assert rv['outcome'] == 'ok'
+
+    names = [p['name'] for p in rv['phases']]
+    assert names == ['parse', 'validate', 'inputs', 'keys', 'outputs', 'summary',
+                        'approve', 'unlock', 'change_check', 'sign',
+                        'finalize' if finalize else 'save']
+    for p in rv['phases']:
+        assert p['us'] >= 0
+        assert p['peak'] > 0
+        assert p['gcs'] >= 0
+
+    assert rv['total_us'] >= sum(p['us'] for p in rv['phases'])
+    assert rv['peak'] == max(p['peak'] for p in rv['phases'])
+
+def test_phase_timing_refused(dev, fake_txn, start_sign, end_sign):
+    psbt = fake_txn(2, 2, dev.master_xpub, segwit_in=True)
+
+    start_sign(psbt)
+    end_sign(accept=False)
+
+    rv = json.loads(dev.send_recv(b'ptim', timeout=None))
+    assert rv['outcome'] == 'refused'
+    assert rv['phases'][-1]['name'] == 'summary'
+
 if 0:
     # TODO: attempt to re-create the mega transaction: 5,569 inputs, one out
     # see <https://bitcoin.stackexchange.com/questions/11542>